@@ -0,0 +1,126 @@
+import argparse
+import warnings
+import numpy as np
+from scripts.tilemap import Tilemap
+
+# image heights of the large decor variants, so they stand on the ground
+LARGE_DECOR_HEIGHTS = {0: 9, 1: 12, 2: 44}
+# platforms placed per grid cell before giving up on the density, most miss once the free rows fill up
+PLATFORM_ATTEMPTS_PER_CELL = 1
+
+
+# procedural level in the data/maps json schema, for benchmarks and stress tests
+# a random walk ground line with floating platforms on top, autotiled like a hand made map
+# density is roughly the fraction of the width x height grid that ends up solid
+def generate_map(width=512,
+                 height=64,
+                 density=0.3,
+                 decor=0.1,
+                 enemies=20,
+                 trees=30,
+                 bushes=30,
+                 seed=0,
+                 tile_size=16):
+    rng = np.random.default_rng(seed)
+    tilemap = Tilemap(None, tile_size)
+
+    # ground height of every column, a bounded random walk
+    ground = np.empty(width, dtype=np.int64)
+    level = height * 2 // 3
+    for x in range(width):
+        level = int(
+            np.clip(level + rng.integers(-1, 2), height // 3, height - 2))
+        ground[x] = level
+    solid = np.arange(height)[:, None] >= ground[None, :]
+
+    # platforms fill the rest of the density budget
+    # they only go from row 2 to 4 rows above the ground and never in the last column,
+    # so a density needing more than that is clamped
+    rows = np.arange(height)[:, None]
+    room = (rows >= 2) & (rows <= ground[None, :] - 4)
+    room[:, -1] = False
+    count = int(solid.sum())
+    capacity = count + int(room.sum())
+    target = int(density * width * height)
+    if target > capacity:
+        warnings.warn('density %.2f does not fit a %dx%d map, using %.2f' %
+                      (density, width, height, capacity / (width * height)))
+        target = capacity
+    for _ in range(PLATFORM_ATTEMPTS_PER_CELL * width * height):
+        if count >= target:
+            break
+        length = int(rng.integers(3, 12))
+        x = int(rng.integers(0, width - length))
+        y = int(rng.integers(2, max(3, ground[x:x + length].min() - 3)))
+        count += length - int(np.count_nonzero(solid[y, x:x + length]))
+        solid[y, x:x + length] = True
+    if count < target:
+        warnings.warn('gave up placing platforms at density %.2f of %.2f' %
+                      (count / (width * height), target / (width * height)))
+
+    ys, xs = np.nonzero(solid)
+    surface = np.roll(solid, 1, axis=0)
+    surface[0] = False
+    for x, y, covered in zip(xs.tolist(), ys.tolist(), surface[ys,
+                                                               xs].tolist()):
+        # grass on top, stone underneath
+        tilemap.set_tile(x, y, 'stone' if covered else 'grass')
+    tilemap.autotile()
+
+    # tiles with air above them, where decor and spawners stand
+    tops = np.flatnonzero((solid & ~surface).ravel())
+    top_xs = (tops % width).tolist()
+    top_ys = (tops // width).tolist()
+    top_count = len(top_xs)
+
+    for i in rng.choice(top_count, int(top_count * decor), replace=False):
+        if tilemap.tile_type_at(top_xs[i], top_ys[i] - 1) == 0:
+            tilemap.set_tile(top_xs[i], top_ys[i] - 1, 'decor',
+                             int(rng.integers(0, 4)))
+    # large decor is offgrid, variant 2 is a tree that spawns leaves and 0/1 are bushes
+    placements = [(2, trees), (0, bushes // 2), (1, bushes - bushes // 2)]
+    for variant, amount in placements:
+        for i in rng.integers(0, top_count, amount).tolist():
+            tilemap.add_offgrid({
+                'type':
+                'large_decor',
+                'variant':
+                variant,
+                'pos': [
+                    top_xs[i] * tile_size + float(rng.uniform(-8, 8)),
+                    top_ys[i] * tile_size - LARGE_DECOR_HEIGHTS[variant]
+                ]
+            })
+
+    # the player starts on the leftmost surface, enemies anywhere on the surface
+    player = int(np.argmin(top_xs))
+    spawns = [(0, player)] + [
+        (1, i) for i in rng.integers(0, top_count, enemies).tolist()
+    ]
+    for variant, i in spawns:
+        tilemap.add_offgrid({
+            'type':
+            'spawners',
+            'variant':
+            variant,
+            'pos': [top_xs[i] * tile_size + 4, top_ys[i] * tile_size - 15]
+        })
+    return tilemap
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='write a synthetic map (.json or .tmap)')
+    parser.add_argument('path')
+    parser.add_argument('--width', type=int, default=512)
+    parser.add_argument('--height', type=int, default=64)
+    parser.add_argument('--density', type=float, default=0.3)
+    parser.add_argument('--decor', type=float, default=0.1)
+    parser.add_argument('--enemies', type=int, default=20)
+    parser.add_argument('--trees', type=int, default=30)
+    parser.add_argument('--bushes', type=int, default=30)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    generate_map(args.width, args.height, args.density, args.decor,
+                 args.enemies, args.trees, args.bushes,
+                 args.seed).save(args.path)
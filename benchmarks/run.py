@@ -0,0 +1,371 @@
+import os
+
+# headless, the benchmarks never open a window
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+
+import argparse
+import asyncio
+import json
+import platform
+import sys
+import tempfile
+import time
+import numpy as np
+import pygame
+from benchmarks.mapgen import generate_map
+from scripts.assets import load_assets
+from scripts.clouds import Clouds
+from scripts.entities import PhysicsEntity
+from scripts.particle import ParticleSystem
+from scripts.physics import PhysicsBodies
+from scripts.render_queue import RenderQueue
+from scripts.snapshot import SnapshotRing, from_bytes
+from scripts.spark import SparkSystem
+from scripts.tilemap import Tilemap
+from scripts.world import World, Inputs
+
+VIEW_SIZE = (320, 240)
+
+# name -> (setup function, calls per timed run)
+# setup takes the shared context and returns the function that is timed
+BENCHMARKS = {}
+
+
+def benchmark(name, number=1):
+
+    def register(setup):
+        BENCHMARKS[name] = (setup, number)
+        return setup
+
+    return register
+
+
+# state shared by the benchmarks, built once: the synthetic map, assets and a display
+class Context:
+
+    def __init__(self, map_args, seed=0):
+        pygame.init()
+        pygame.display.set_mode(VIEW_SIZE)
+        self.display = pygame.Surface(VIEW_SIZE)
+        self.assets = load_assets()
+        self.rng = np.random.default_rng(seed)
+        self.tempdir = tempfile.TemporaryDirectory()
+        # the map is the only level in its directory, so worlds read it on every (re)load
+        self.maps_path = self.tempdir.name + os.sep
+        self.map_path = self.maps_path + '0.json'
+        generate_map(seed=seed, **map_args).save(self.map_path)
+        self.tilemap = self.load_tilemap()
+        self.map_pixels = np.array(self.tilemap.bounds()[2:]) * 16
+
+    def load_tilemap(self):
+        tilemap = Tilemap(self, tile_size=16)
+        asyncio.run(tilemap.load(self.map_path))
+        return tilemap
+
+    # random pixel positions inside the map
+    def positions(self, count):
+        return (self.rng.random((count, 2)) * self.map_pixels).tolist()
+
+    def close(self):
+        self.tempdir.cleanup()
+
+
+# minimal game object for entities, they only need assets and the bodies arrays
+class BenchGame:
+
+    def __init__(self, assets):
+        self.assets = assets
+        self.bodies = PhysicsBodies()
+
+
+@benchmark('tilemap.load')
+def bench_tilemap_load(ctx):
+    return ctx.load_tilemap
+
+
+@benchmark('tilemap.tiles_around', number=1000)
+def bench_tiles_around(ctx):
+    positions = iter(ctx.positions(100000))
+    tiles_around = ctx.tilemap.tiles_around
+    return lambda: tiles_around(next(positions))
+
+
+@benchmark('tilemap.solid_check', number=1000)
+def bench_solid_check(ctx):
+    positions = iter(ctx.positions(100000))
+    solid_check = ctx.tilemap.solid_check
+    return lambda: solid_check(next(positions))
+
+
+@benchmark('tilemap.render_cold', number=10)
+def bench_render_cold(ctx):
+    offsets = iter(ctx.positions(10000))
+
+    def run():
+        ctx.tilemap.render_cache.clear()
+        ctx.tilemap.render(ctx.display, offset=next(offsets))
+
+    return run
+
+
+@benchmark('tilemap.render_warm', number=100)
+def bench_render_warm(ctx):
+    offset = ctx.positions(1)[0]
+    ctx.tilemap.render(ctx.display, offset=offset)
+    return lambda: ctx.tilemap.render(ctx.display, offset=offset)
+
+
+@benchmark('tilemap.autotile')
+def bench_autotile(ctx):
+    return ctx.tilemap.autotile
+
+
+# entities stepped one at a time through PhysicsEntity.update
+@benchmark('physics.entity_update', number=10)
+def bench_entity_update(ctx):
+    game = BenchGame(ctx.assets)
+    entities = [
+        PhysicsEntity(game, 'player', pos, (8, 15))
+        for pos in ctx.positions(200)
+    ]
+
+    def run():
+        for entity in entities:
+            entity.update(ctx.tilemap, (1, 0))
+
+    return run
+
+
+# the same bodies moved with one batched call
+@benchmark('physics.batched', number=10)
+def bench_physics_batched(ctx):
+    game = BenchGame(ctx.assets)
+    for pos in ctx.positions(200):
+        PhysicsEntity(game, 'player', pos, (8, 15))
+    slots = np.arange(game.bodies.count)
+    movement = np.tile((1., 0.), (len(slots), 1))
+
+    def run():
+        game.bodies.move_and_collide(ctx.tilemap, slots, movement)
+        game.bodies.apply_friction(slots)
+
+    return run
+
+
+# a full pool of particles updated and drawn, refilled as they expire
+@benchmark('particles.storm', number=10)
+def bench_particle_storm(ctx):
+    particles = ParticleSystem(ctx.assets)
+    rng = np.random.default_rng(1)
+
+    def run():
+        missing = particles.capacity - particles.count
+        particles.add_many('particle',
+                           rng.random((missing, 2)) * VIEW_SIZE,
+                           rng.normal(0, 1, (missing, 2)),
+                           rng.integers(0, 8, missing))
+        particles.update()
+        particles.render(ctx.display)
+
+    return run
+
+
+@benchmark('sparks.storm', number=10)
+def bench_spark_storm(ctx):
+    sparks = SparkSystem()
+    rng = np.random.default_rng(2)
+
+    def run():
+        missing = sparks.capacity - sparks.count
+        sparks.add_many(
+            rng.random((missing, 2)) * VIEW_SIZE,
+            rng.random(missing) * 2 * np.pi,
+            rng.random(missing) * 3 + 2)
+        sparks.update()
+        sparks.render(ctx.display)
+
+    return run
+
+
+# a world on the benchmark map stepped a little so every pool has something in it
+def bench_world(ctx):
+    world = World(ctx.assets,
+                  view_size=VIEW_SIZE,
+                  seed=0,
+                  maps_path=ctx.maps_path)
+    rng = np.random.default_rng(4)
+    for _ in range(120):
+        world.step(Inputs(int(rng.integers(-1, 2)), rng.random() < 0.05))
+    for _ in range(10):
+        world.death_burst(world.player.rect().center)
+    return world
+
+
+# one simulation step and one frame drawn the way Game.render draws it
+@benchmark('frame.full', number=10)
+def bench_full_frame(ctx):
+    world = World(ctx.assets,
+                  view_size=VIEW_SIZE,
+                  seed=0,
+                  maps_path=ctx.maps_path)
+    clouds = Clouds(ctx.assets['clouds'], count=16, seed=0)
+    queue = RenderQueue(ctx.display)
+    rng = np.random.default_rng(3)
+
+    def run():
+        world.step(
+            Inputs(int(rng.integers(-1, 2)),
+                   rng.random() < 0.05,
+                   rng.random() < 0.02))
+        offset = world.render_scroll()
+        queue.blit(ctx.assets['background'], (0, 0))
+        clouds.update()
+        clouds.render(queue, offset=offset)
+        world.tilemap.render(queue, offset=offset)
+        for enemy in world.enemies:
+            enemy.render(queue, offset=offset)
+        if not world.dead:
+            world.player.render(queue, offset=offset)
+        world.projectiles.render(queue, offset=offset)
+        queue.flush()
+        world.sparks.render(ctx.display, offset=offset)
+        world.particles.render(queue, offset=offset)
+        queue.flush()
+
+    return run
+
+
+# capturing the whole world state mid level, pushed into a ring of recent frames
+@benchmark('world.snapshot', number=100)
+def bench_world_snapshot(ctx):
+    world = bench_world(ctx)
+    ring = SnapshotRing(60)
+    return lambda: ring.push(world.snapshot())
+
+
+# putting the world back into a snapshot taken some steps earlier, through the bytes format
+@benchmark('world.restore', number=100)
+def bench_world_restore(ctx):
+    world = bench_world(ctx)
+    snapshot = from_bytes(world.snapshot().tobytes())
+    for _ in range(60):
+        world.step(Inputs(1))
+    return lambda: world.restore(snapshot)
+
+
+# milliseconds per call of every timed run
+def measure(run, number, repeat):
+    # one untimed run to warm caches
+    run()
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            run()
+        times.append((time.perf_counter() - start) * 1000 / number)
+    return times
+
+
+def run_benchmarks(names, repeat, map_args, seed=0):
+    ctx = Context(map_args, seed)
+    results = {}
+    try:
+        for name in names:
+            setup, number = BENCHMARKS[name]
+            times = measure(setup(ctx), number, repeat)
+            results[name] = {
+                'median_ms': float(np.median(times)),
+                'min_ms': float(np.min(times)),
+                'max_ms': float(np.max(times)),
+                'number': number,
+                'repeat': repeat,
+            }
+            print('%-24s %10.4f ms' % (name, results[name]['median_ms']),
+                  file=sys.stderr)
+    finally:
+        ctx.close()
+    return {
+        'meta': {
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'pygame': pygame.version.ver,
+            'numpy': np.__version__,
+            'map': map_args,
+            'seed': seed,
+        },
+        'results': results,
+    }
+
+
+# benchmarks whose median got slower than base by more than threshold (0.1 = 10%)
+def compare(base, new, threshold=0.1):
+    regressions = []
+    print('%-24s %10s %10s %7s' % ('benchmark', 'base ms', 'new ms', 'ratio'))
+    for name in sorted(base['results'].keys() & new['results'].keys()):
+        old_ms = base['results'][name]['median_ms']
+        new_ms = new['results'][name]['median_ms']
+        ratio = new_ms / old_ms if old_ms else float('inf')
+        flag = ''
+        if ratio > 1 + threshold:
+            flag = '  REGRESSION'
+            regressions.append(name)
+        elif ratio < 1 - threshold:
+            flag = '  faster'
+        print('%-24s %10.4f %10.4f %6.2fx%s' %
+              (name, old_ms, new_ms, ratio, flag))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='headless benchmarks, writes json results')
+    parser.add_argument('--output', help='json file for the results')
+    parser.add_argument('--filter',
+                        default='',
+                        help='only run benchmarks whose name contains this')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--width', type=int, default=512)
+    parser.add_argument('--height', type=int, default=64)
+    parser.add_argument('--density', type=float, default=0.3)
+    parser.add_argument('--decor', type=float, default=0.1)
+    parser.add_argument('--enemies', type=int, default=20)
+    parser.add_argument('--trees', type=int, default=30)
+    parser.add_argument('--bushes', type=int, default=30)
+    parser.add_argument('--compare',
+                        nargs=2,
+                        metavar=('BASE', 'NEW'),
+                        help='compare two result files instead of running')
+    parser.add_argument('--threshold', type=float, default=0.1)
+    args = parser.parse_args()
+
+    if args.compare:
+        with open(args.compare[0]) as f:
+            base = json.load(f)
+        with open(args.compare[1]) as f:
+            new = json.load(f)
+        regressions = compare(base, new, args.threshold)
+        sys.exit(1 if regressions else 0)
+
+    map_args = {
+        'width': args.width,
+        'height': args.height,
+        'density': args.density,
+        'decor': args.decor,
+        'enemies': args.enemies,
+        'trees': args.trees,
+        'bushes': args.bushes,
+    }
+    names = [name for name in BENCHMARKS if args.filter in name]
+    results = run_benchmarks(names, args.repeat, map_args, args.seed)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    else:
+        print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,34 +1,34 @@
 import sys
 import pygame
-from scripts.utils import load_images
+import asyncio
 from scripts.tilemap import Tilemap
+from scripts.assets import AssetManager, ASSETS, EDITOR_ASSETS
+from scripts.present import Presenter
 
 RENDER_SCALE = 2.0
 
 
 class Editor:
 
-    def __init__(self):
+    def __init__(self, pipelined=False):
         pygame.init()
         pygame.display.set_caption('editor')
         self.screen = pygame.display.set_mode((640, 480))
 
-        self.display = pygame.Surface((320, 240))
+        # pipelined scales the last frame on a worker thread while the next one is drawn
+        self.presenter = Presenter(self.screen, (320, 240), pipelined)
+        self.display = self.presenter.display
 
         self.clock = pygame.time.Clock()
         self.movement = [False, False, False, False]
 
-        self.assets = {
-            'decor': load_images('tiles/decor'),
-            'grass': load_images('tiles/grass'),
-            'large_decor': load_images('tiles/large_decor'),
-            'stone': load_images('tiles/stone'),
-            'spawners': load_images('tiles/spawners'),
-        }
+        self.assets = AssetManager(
+            {name: ASSETS[name]
+             for name in EDITOR_ASSETS})
 
         self.tilemap = Tilemap(self, tile_size=16)
         try:
-            self.tilemap.load('map.json')
+            asyncio.run(self.tilemap.load('map.json'))
         except FileNotFoundError:
             pass
 
@@ -42,9 +42,13 @@ class Editor:
         self.right_clicking = False
         self.shift = False
         self.ongrid = True
+        # re-autotile the tiles around every painted or deleted tile
+        self.live_autotile = False
 
     def run(self):
         while True:
+            # draw on whichever display buffer isn't being presented
+            self.display = self.presenter.display
             #background
             self.display.fill((0, 0, 0))
 
@@ -83,29 +87,26 @@ class Editor:
 
             # Add tile at mouse position to tilemap
             if self.clicking and self.ongrid:
-                self.tilemap.tilemap[str(tile_pos[0]) + ';' +
-                                     str(tile_pos[1])] = {
-                                         'type':
-                                         self.tile_list[self.tile_group],
-                                         'variant': self.tile_variant,
-                                         'pos': tile_pos
-                                     }
+                tile_type = self.tile_list[self.tile_group]
+                # live autotiling picks the variant, so only repaint when the type changes
+                if not self.live_autotile:
+                    self.tilemap.set_tile(tile_pos[0], tile_pos[1], tile_type,
+                                          self.tile_variant)
+                elif self.tilemap.tile_type_at(
+                        *tile_pos) != self.tilemap.type_id(tile_type):
+                    self.tilemap.set_tile(tile_pos[0], tile_pos[1], tile_type,
+                                          self.tile_variant)
+                    self.tilemap.autotile_around(*tile_pos)
             # Delete tile at mouse position if in tilemap
             if self.right_clicking:
                 # delete ongrid tiles
-                tile_loc = str(tile_pos[0]) + ';' + str(tile_pos[1])
-                if tile_loc in self.tilemap.tilemap:
-                    del self.tilemap.tilemap[tile_loc]
-                # delete offgrid tiles
-                for tile in self.tilemap.offgrid_tiles.copy():
-                    # take img to figure out how big the hitbox should be for deletion
-                    tile_img = self.assets[tile['type']][tile['variant']]
-                    tile_r = pygame.Rect(tile['pos'][0] - self.scroll[0],
-                                         tile['pos'][1] - self.scroll[1],
-                                         tile_img.get_width(),
-                                         tile_img.get_height())
-                    if tile_r.collidepoint(mpos):
-                        self.tilemap.offgrid_tiles.remove(tile)
+                if self.tilemap.remove_tile(
+                        tile_pos[0], tile_pos[1]) and self.live_autotile:
+                    self.tilemap.autotile_around(*tile_pos)
+                # delete offgrid tiles under the mouse
+                for tile in self.tilemap.offgrid_at(
+                    (mpos[0] + self.scroll[0], mpos[1] + self.scroll[1])):
+                    self.tilemap.remove_offgrid(tile)
 
             # display currently selected tile at top left of screen
             self.display.blit(current_tile_img, (5, 5))
@@ -113,6 +114,7 @@ class Editor:
             # react to mouse and keyboard inputs
             for event in pygame.event.get():
                 if event.type == pygame.QUIT:
+                    self.presenter.close()
                     pygame.quit()
                     sys.exit()
 
@@ -121,7 +123,7 @@ class Editor:
                         self.clicking = True
                         # if not on grid, add tile to offgrid tiles at mpos
                         if not self.ongrid:
-                            self.tilemap.offgrid_tiles.append({
+                            self.tilemap.add_offgrid({
                                 'type':
                                 self.tile_list[self.tile_group],
                                 'variant':
@@ -171,6 +173,8 @@ class Editor:
                         self.tilemap.save('map.json')
                     if event.key == pygame.K_t:
                         self.tilemap.autotile()
+                    if event.key == pygame.K_i:
+                        self.live_autotile = not self.live_autotile
 
                 if event.type == pygame.KEYUP:
                     if event.key == pygame.K_a:
@@ -184,12 +188,9 @@ class Editor:
                     if event.key == pygame.K_LSHIFT or event.key == pygame.K_RSHIFT:
                         self.shift = False
 
-            self.screen.blit(
-                pygame.transform.scale(self.display, self.screen.get_size()),
-                (0, 0))
-            pygame.display.update()
+            self.presenter.present()
             self.clock.tick(
                 60)  # a dynamic sleep so that the window runs at 60 fps
 
 
-Editor().run()
+Editor(pipelined='--pipelined' in sys.argv).run()
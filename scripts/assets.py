@@ -0,0 +1,270 @@
+import json
+import os
+import struct
+import time
+from collections.abc import MutableMapping
+from concurrent.futures import ThreadPoolExecutor
+import pygame
+from scripts.utils import BASE_IMG_PATH, Animation, prepare_img
+from scripts.atlas import Atlas, pack_images
+
+# pre-processed packs live here, one per asset group
+ASSET_CACHE_DIR = '.cache/assets'
+PACK_MAGIC = b'APAK'
+# bump when the pack layout changes so old packs are rebuilt
+PACK_VERSION = 1
+
+# name -> (group, kind, path, options)
+# image is one file, images a directory of frames, animation a directory played as an Animation with options,
+# flipped is the mirror image of the asset named by path
+# every group is packed into its own atlas and cached on disk as one pack
+ASSETS = {
+    'decor': ('tiles/decor', 'images', 'tiles/decor', {}),
+    'grass': ('tiles/grass', 'images', 'tiles/grass', {}),
+    'large_decor': ('tiles/large_decor', 'images', 'tiles/large_decor', {}),
+    'stone': ('tiles/stone', 'images', 'tiles/stone', {}),
+    'spawners': ('tiles/spawners', 'images', 'tiles/spawners', {}),
+    'player': ('entities', 'image', 'entities/player.png', {}),
+    'background': ('background', 'image', 'background.png', {}),
+    'clouds': ('background', 'images', 'clouds', {}),
+    'player/idle': ('entities', 'animation', 'entities/player/idle', {
+        'img_dur': 6
+    }),
+    'player/run': ('entities', 'animation', 'entities/player/run', {
+        'img_dur': 4
+    }),
+    'player/jump': ('entities', 'animation', 'entities/player/jump', {}),
+    'player/slide': ('entities', 'animation', 'entities/player/slide', {}),
+    'player/wall_slide':
+    ('entities', 'animation', 'entities/player/wall_slide', {}),
+    'enemy/idle': ('entities', 'animation', 'entities/enemy/idle', {
+        'img_dur': 6
+    }),
+    'enemy/run': ('entities', 'animation', 'entities/enemy/run', {
+        'img_dur': 4
+    }),
+    'particle/leaf': ('particles', 'animation', 'particles/leaf', {
+        'img_dur': 20,
+        'loop': False
+    }),
+    'particle/particle': ('particles', 'animation', 'particles/particle', {
+        'img_dur': 6,
+        'loop': False
+    }),
+    'gun': ('entities', 'image', 'gun.png', {}),
+    'gun_flipped': ('entities', 'flipped', 'gun', {}),
+    'projectile': ('entities', 'image', 'projectile.png', {}),
+}
+
+# groups the game draws before any level is loaded, tile groups follow the level's palette
+GAME_GROUPS = ('entities', 'particles', 'background')
+EDITOR_ASSETS = ('decor', 'grass', 'large_decor', 'stone', 'spawners')
+
+
+# asset dict that loads a whole group the first time one of its assets is looked up
+# a group is read from its pack when the pack is newer than every source file,
+# otherwise its pngs are decoded on a thread pool, packed into an atlas and the pack is rewritten
+# works without a display so headless simulations can build the same animations
+class AssetManager(MutableMapping):
+
+    def __init__(self,
+                 specs=ASSETS,
+                 preload=None,
+                 cache_dir=ASSET_CACHE_DIR,
+                 workers=None):
+        self.specs = dict(specs)
+        self.groups = {}
+        for name, spec in self.specs.items():
+            self.groups.setdefault(spec[0], []).append(name)
+        self.assets = {}
+        self.atlases = {}
+        self.cache_dir = cache_dir
+        self.workers = workers
+        # group -> (where it came from, 'pack' or 'decoded', milliseconds)
+        self.timings = {}
+
+        start = time.perf_counter()
+        self.load_groups(self.groups if preload is None else preload)
+        self.startup_ms = (time.perf_counter() - start) * 1000
+
+    def __getitem__(self, name):
+        if name not in self.assets and name in self.specs:
+            self.load_groups([self.specs[name][0]])
+        return self.assets[name]
+
+    def __setitem__(self, name, value):
+        self.assets[name] = value
+
+    def __delitem__(self, name):
+        if name not in self:
+            raise KeyError(name)
+        self.specs.pop(name, None)
+        self.assets.pop(name, None)
+
+    # names in spec order, then anything set by hand
+    def __iter__(self):
+        yield from self.specs
+        for name in self.assets:
+            if name not in self.specs:
+                yield name
+
+    def __len__(self):
+        return len(self.specs.keys() | self.assets.keys())
+
+    def __contains__(self, name):
+        return name in self.specs or name in self.assets
+
+    # load the groups of these asset names now rather than on first access, unknown names are skipped
+    def preload(self, names):
+        self.load_groups(
+            [self.specs[name][0] for name in names if name in self.specs])
+
+    # name -> image files of every asset in a group, in frame order
+    def files(self, group):
+        files = {}
+        for name in self.groups[group]:
+            kind, path = self.specs[name][1:3]
+            if kind == 'image':
+                files[name] = [BASE_IMG_PATH + path]
+            elif kind == 'flipped':
+                files[name] = []
+            else:
+                files[name] = [
+                    BASE_IMG_PATH + path + '/' + img_name
+                    for img_name in sorted(os.listdir(BASE_IMG_PATH + path))
+                ]
+        return files
+
+    # what a pack was built from, any change to a file's mtime or size or to the specs invalidates it
+    def signature(self, group, files):
+        signature = []
+        for name in self.groups[group]:
+            signature.append([name] + list(self.specs[name][1:3]))
+            for path in files[name]:
+                stat = os.stat(path)
+                signature.append([path, stat.st_mtime_ns, stat.st_size])
+        return signature
+
+    def pack_path(self, group):
+        return os.path.join(self.cache_dir, group.replace('/', '_') + '.pack')
+
+    def load_groups(self, groups):
+        groups = [
+            group for group in dict.fromkeys(groups)
+            if group not in self.atlases
+        ]
+        if not groups:
+            return
+        files = {group: self.files(group) for group in groups}
+        missing = []
+        for group in groups:
+            start = time.perf_counter()
+            signature = self.signature(group, files[group])
+            atlas = self.read_pack(group, signature)
+            if atlas is None:
+                missing.append((group, signature))
+                continue
+            self.build(group, atlas, files[group])
+            self.timings[group] = ('pack',
+                                   (time.perf_counter() - start) * 1000)
+
+        if not missing:
+            return
+        # every png of the groups without a valid pack is decoded in one go
+        start = time.perf_counter()
+        paths = [
+            path for group, _ in missing for paths in files[group].values()
+            for path in paths
+        ]
+        with ThreadPoolExecutor(self.workers) as pool:
+            decoded = dict(zip(paths, pool.map(pygame.image.load, paths)))
+        decode_ms = (time.perf_counter() - start) * 1000 / len(missing)
+        for group, signature in missing:
+            start = time.perf_counter()
+            # converting needs the display, so it stays on this thread
+            atlas = pack_images([
+                prepare_img(decoded[path]) for paths in files[group].values()
+                for path in paths
+            ])
+            self.build(group, atlas, files[group])
+            self.write_pack(group, signature, atlas)
+            self.timings[group] = ('decoded', decode_ms +
+                                   (time.perf_counter() - start) * 1000)
+
+    # put the atlas frames of a group into the asset dict
+    def build(self, group, atlas, files):
+        frames = iter(atlas.frames)
+        for name in self.groups[group]:
+            kind, path, options = self.specs[name][1:]
+            if kind == 'image':
+                self.assets[name] = next(frames)
+            elif kind == 'images':
+                self.assets[name] = [next(frames) for _ in files[name]]
+            elif kind == 'animation':
+                packed = [next(frames) for _ in files[name]]
+                self.assets[name] = Animation(
+                    packed,
+                    flipped=[atlas.flipped(f) for f in packed],
+                    **options)
+        for name in self.groups[group]:
+            kind, path = self.specs[name][1:3]
+            if kind == 'flipped':
+                self.assets[name] = atlas.flipped(self.assets[path])
+        self.atlases[group] = atlas
+
+    # the atlas stored in a group's pack, None if there is no pack or it is stale
+    def read_pack(self, group, signature):
+        if self.cache_dir is None:
+            return None
+        try:
+            with open(self.pack_path(group), 'rb') as f:
+                magic, header_size = struct.unpack('<4sI', f.read(8))
+                if magic != PACK_MAGIC:
+                    return None
+                header = json.loads(f.read(header_size))
+                if (header['version'] != PACK_VERSION
+                        or header['signature'] != signature):
+                    return None
+                pixels = f.read()
+        except (OSError, ValueError, KeyError, struct.error):
+            return None
+        size = tuple(header['size'])
+        if len(pixels) != size[0] * size[1] * 3:
+            return None
+        surface = pygame.image.frombytes(pixels, size, 'RGB')
+        return Atlas(surface, [pygame.Rect(rect) for rect in header['rects']])
+
+    # header json then the raw rgb pixels of the atlas, written to a temp file and renamed into place
+    def write_pack(self, group, signature, atlas):
+        if self.cache_dir is None:
+            return
+        header = json.dumps({
+            'version': PACK_VERSION,
+            'signature': signature,
+            'size': atlas.surface.get_size(),
+            'rects': [list(rect) for rect in atlas.rects],
+        }).encode()
+        path = self.pack_path(group)
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            with open(path + '.tmp', 'wb') as f:
+                f.write(struct.pack('<4sI', PACK_MAGIC, len(header)))
+                f.write(header)
+                f.write(pygame.image.tobytes(atlas.surface, 'RGB'))
+            os.replace(path + '.tmp', path)
+        except OSError:
+            # a read only checkout still runs, it just decodes every start
+            pass
+
+    # startup time and how every group loaded so far was loaded
+    def report(self):
+        lines = ['assets: %.1f ms startup' % self.startup_ms]
+        for group, (source, ms) in self.timings.items():
+            lines.append('  %-18s %-7s %7.2f ms' % (group, source, ms))
+        return '\n'.join(lines)
+
+
+# every image and animation used by the game
+# groups outside preload load on first access
+def load_assets(preload=GAME_GROUPS, cache_dir=ASSET_CACHE_DIR):
+    return AssetManager(ASSETS, preload, cache_dir)
@@ -0,0 +1,53 @@
+import pygame
+
+ATLAS_WIDTH = 512
+# empty space between images so nothing bleeds into a neighbour
+ATLAS_PADDING = 1
+
+
+# every image packed into one surface, images become subsurfaces of it
+# a horizontally flipped copy of the whole atlas is made once, so flipped frames are subsurfaces too
+# built from an already packed surface and the rects of its images, pack_images does the packing
+class Atlas:
+
+    def __init__(self, surface, rects):
+        # black is the colorkey for every image, so the gaps are transparent too
+        if pygame.display.get_surface() is not None:
+            surface = surface.convert()
+        surface.set_colorkey((0, 0, 0))
+        self.surface = surface
+        self.rects = rects
+        self.flipped_surface = pygame.transform.flip(self.surface, True, False)
+        self.flipped_surface.set_colorkey((0, 0, 0))
+
+        self.frames = [self.surface.subsurface(rect) for rect in self.rects]
+
+    # the mirror image of a packed subsurface
+    def flipped(self, frame):
+        x, y = frame.get_offset()
+        w, h = frame.get_size()
+        return self.flipped_surface.subsurface(
+            (self.surface.get_width() - x - w, y, w, h))
+
+
+def pack_images(images, width=ATLAS_WIDTH, padding=ATLAS_PADDING):
+    width = max([width] + [img.get_width() + padding for img in images])
+    # shelf packing, tallest images first so the shelves waste little space
+    order = sorted(range(len(images)),
+                   key=lambda i: images[i].get_height(),
+                   reverse=True)
+    rects = [None] * len(images)
+    x = y = shelf_height = 0
+    for i in order:
+        w, h = images[i].get_size()
+        if x + w > width:
+            x = 0
+            y += shelf_height + padding
+            shelf_height = 0
+        rects[i] = pygame.Rect(x, y, w, h)
+        x += w + padding
+        shelf_height = max(shelf_height, h)
+
+    surface = pygame.Surface((width, y + shelf_height))
+    surface.blits(list(zip(images, rects)), doreturn=False)
+    return Atlas(surface, rects)
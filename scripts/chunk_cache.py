@@ -0,0 +1,192 @@
+import math
+import pygame
+import numpy as np
+from collections import OrderedDict
+
+# memory cap for baked chunk surfaces, 256x256 chunks at 4 bytes per pixel are 256KB each
+DEFAULT_CACHE_BYTES = 32 * 1024 * 1024
+# rough cost of remembering that a chunk has nothing to draw
+EMPTY_ENTRY_BYTES = 64
+
+
+def entry_bytes(surf):
+    if surf is None:
+        return EMPTY_ENTRY_BYTES
+    return surf.get_width() * surf.get_height() * surf.get_bytesize()
+
+
+class ChunkRenderCache:
+
+    def __init__(self, tilemap, chunk_size, max_bytes=DEFAULT_CACHE_BYTES):
+        self.tilemap = tilemap
+        # chunk size in tiles, the pixel size follows the tilemap's tile_size
+        self.chunk_size = chunk_size
+        self.max_bytes = max_bytes
+        # (chunk_x, chunk_y) -> baked surface, or None if the chunk has nothing to draw
+        # ordered from least to most recently used
+        self.surfaces = OrderedDict()
+        self.used_bytes = 0
+        # tile type -> (width, height) of its largest image
+        self.extents = {}
+
+    def chunk_pixels(self):
+        return self.chunk_size * self.tilemap.tile_size
+
+    def invalidate(self, key):
+        if key in self.surfaces:
+            self.used_bytes -= entry_bytes(self.surfaces.pop(key))
+
+    # drop a chunk after its grid tiles changed, and the chunks right and below it
+    # that the images of grid tiles of these type ids can reach into
+    def invalidate_tiles(self, key, type_ids):
+        reach_x, reach_y = self.overhang(type_ids)
+        for cx in range(key[0], key[0] + reach_x + 1):
+            for cy in range(key[1], key[1] + reach_y + 1):
+                self.invalidate((cx, cy))
+
+    # invalidate every chunk touched by a pixel rect, used for offgrid tiles
+    def invalidate_rect(self, rect):
+        size = self.chunk_pixels()
+        for cx in range(int(rect[0] // size),
+                        int((rect[0] + rect[2]) // size) + 1):
+            for cy in range(int(rect[1] // size),
+                            int((rect[1] + rect[3]) // size) + 1):
+                self.invalidate((cx, cy))
+
+    def clear(self):
+        self.surfaces.clear()
+        self.used_bytes = 0
+
+    def get(self, key):
+        if key in self.surfaces:
+            self.surfaces.move_to_end(key)
+            return self.surfaces[key]
+
+        surf = self.bake(key)
+        self.surfaces[key] = surf
+        self.used_bytes += entry_bytes(surf)
+        # drop least recently used chunks until we are under the cap again
+        while self.used_bytes > self.max_bytes and len(self.surfaces) > 1:
+            self.invalidate(next(iter(self.surfaces)))
+        return surf
+
+    # size of the largest image of a tile type, None without a game or assets for the type
+    def tile_extent(self, tile_type):
+        if tile_type not in self.extents:
+            game = self.tilemap.game
+            if game is None or tile_type not in game.assets:
+                return None
+            images = game.assets[tile_type]
+            self.extents[tile_type] = (max(img.get_width() for img in images),
+                                       max(img.get_height() for img in images))
+        return self.extents[tile_type]
+
+    # how many chunks right and down the images of grid tiles of these type ids reach past their own chunk,
+    # grid tiles are drawn from the top left of their cell so they only overhang that way
+    def overhang(self, type_ids):
+        tilemap = self.tilemap
+        size = self.chunk_pixels()
+        reach_x = reach_y = 0
+        for t_id in type_ids:
+            extent = self.tile_extent(
+                tilemap.tile_types[t_id]) if t_id else None
+            if extent is not None:
+                reach_x = max(
+                    reach_x, math.ceil((extent[0] - tilemap.tile_size) / size))
+                reach_y = max(
+                    reach_y, math.ceil((extent[1] - tilemap.tile_size) / size))
+        return reach_x, reach_y
+
+    # (y, x, image) of the grid tiles in the chunks up and to the left whose image reaches into a chunk
+    def overhanging(self, key):
+        tilemap = self.tilemap
+        assets = tilemap.game.assets
+        ts = tilemap.tile_size
+        size = self.chunk_pixels()
+        type_ids = range(1, len(tilemap.tile_types))
+        reach_x, reach_y = self.overhang(type_ids)
+        if not reach_x and not reach_y:
+            return []
+        chunk_rect = pygame.Rect(key[0] * size, key[1] * size, size, size)
+        oversized = [
+            t_id for t_id in type_ids if self.overhang((t_id, )) != (0, 0)
+        ]
+        tiles = []
+        for cx in range(key[0] - reach_x, key[0] + 1):
+            for cy in range(key[1] - reach_y, key[1] + 1):
+                chunk = tilemap.chunks.get((cx, cy))
+                if (cx, cy) == key or chunk is None:
+                    continue
+                ys, xs = np.nonzero(np.isin(chunk.types, oversized))
+                for ly, lx in zip(ys.tolist(), xs.tolist()):
+                    img = assets[tilemap.tile_types[chunk.types[ly, lx]]][
+                        chunk.variants[ly, lx]]
+                    x = cx * self.chunk_size + lx
+                    y = cy * self.chunk_size + ly
+                    if chunk_rect.colliderect(
+                        (x * ts, y * ts, img.get_width(), img.get_height())):
+                        tiles.append((y, x, img))
+        return tiles
+
+    # draw the offgrid and grid tiles of a chunk onto one surface
+    # grid tiles of neighbouring chunks whose image reaches into the chunk are drawn too,
+    # all grid tiles go in row order so overlapping ones look the same on both sides of a chunk edge
+    def bake(self, key):
+        tilemap = self.tilemap
+        assets = tilemap.game.assets
+        size = self.chunk_pixels()
+        origin = (key[0] * size, key[1] * size)
+        chunk_rect = pygame.Rect(origin[0], origin[1], size, size)
+
+        offgrid = [(assets[tile['type']][tile['variant']], tile['pos'])
+                   for tile in tilemap.offgrid_in_rect(chunk_rect)
+                   if tile['type'] in assets]
+
+        tiles = []
+        chunk = tilemap.chunks.get(key)
+        if chunk is not None:
+            ys, xs = np.nonzero(chunk.types)
+            for ly, lx in zip(ys.tolist(), xs.tolist()):
+                tiles.append(
+                    (key[1] * self.chunk_size + ly,
+                     key[0] * self.chunk_size + lx, assets[tilemap.tile_types[
+                         chunk.types[ly, lx]]][chunk.variants[ly, lx]]))
+        overhanging = self.overhanging(key)
+        if overhanging:
+            tiles = sorted(tiles + overhanging, key=lambda t: (t[0], t[1]))
+        if not offgrid and not tiles:
+            return None
+
+        surf = pygame.Surface((size, size))
+        if pygame.display.get_surface() is not None:
+            surf = surf.convert()
+        # black is transparent like the colorkey of the tile images
+        surf.fill((0, 0, 0))
+        surf.set_colorkey((0, 0, 0))
+
+        # offgrid tiles first because they are background
+        # floor the pixel position so a tile split across chunks lines up on both sides
+        for img, pos in offgrid:
+            surf.blit(img, (math.floor(pos[0]) - origin[0],
+                            math.floor(pos[1]) - origin[1]))
+
+        for y, x, img in tiles:
+            surf.blit(img, (x * tilemap.tile_size - origin[0],
+                            y * tilemap.tile_size - origin[1]))
+        return surf
+
+    # surf can be a surface or a RenderQueue
+    def render(self, surf, offset=(0, 0)):
+        size = self.chunk_pixels()
+        visible = []
+        for cx in range(int(offset[0] // size),
+                        int((offset[0] + surf.get_width()) // size) + 1):
+            for cy in range(int(offset[1] // size),
+                            int((offset[1] + surf.get_height()) // size) + 1):
+                chunk_surf = self.get((cx, cy))
+                if chunk_surf is not None:
+                    visible.append((chunk_surf, (cx, cy)))
+        if visible:
+            chunk_surfs, keys = zip(*visible)
+            dests = (np.array(keys) * size - offset).tolist()
+            surf.blits(zip(chunk_surfs, dests), doreturn=False)
@@ -1,52 +1,51 @@
-import random
 import numpy as np
 
 
-class Cloud:
-
-    def __init__(self, pos, img, speed, depth):
-        self.pos = np.array(pos)
-        self.img = img
-        self.speed = speed
-        self.depth = depth
-
-    def update(self):
-        self.pos[0] += self.speed
-
-    def render(self, surf, offset=np.array((0., 0.))):
-        render_pos = self.pos - offset * self.depth
-
-        print(render_pos)
-        print(surf.get_size())
-        print(self.img.get_size())
-        surf.blit(
-            self.img, render_pos %
-            (np.array(surf.get_size()) + np.array(self.img.get_size())) -
-            np.array(self.img.get_size()))
-
-        # modulo here to loop the image back around when it goes off screen
-        # add img width to modulo so there is a buffer before it loops
-        # - self.img.get_width() and - self.img.get_height() are to wrap image around edge of screen
-
-
+# parallax cloud background, every cloud is a row in the arrays and moves and wraps in one numpy step
+# clouds are spread over layers of increasing depth, deeper layers are drawn later and scroll more
 class Clouds:
 
-    def __init__(self, cloud_images, count=16):
-        self.clouds = []
-
-        for i in range(count):
-            self.clouds.append(
-                Cloud(pos=(random.random() * 99999, random.random() * 99999),
-                      img=random.choice(cloud_images),
-                      speed=random.random() * 0.05 + 0.05,
-                      depth=random.random() * 0.6 + 0.2))
-
-        self.clouds.sort(key=lambda x: x.depth)
+    def __init__(self,
+                 cloud_images,
+                 count=16,
+                 layers=1,
+                 depth_range=(0.2, 0.8),
+                 seed=None):
+        rng = np.random.default_rng(seed)
+        self.images = list(cloud_images)
+        image_sizes = np.array([img.get_size() for img in self.images])
+
+        self.pos = rng.random((count, 2)) * 99999
+        self.speed = rng.random(count) * 0.05 + 0.05
+        # every layer covers an equal slice of the depth range
+        layer = rng.integers(0, layers, count)
+        layer_depth = (depth_range[1] - depth_range[0]) / layers
+        self.depth = (depth_range[0] + layer * layer_depth +
+                      rng.random(count) * layer_depth)
+        self.image_index = rng.integers(0, len(self.images), count)
+
+        # draw in depth order
+        order = np.argsort(self.depth, kind='stable')
+        self.pos = self.pos[order]
+        self.speed = self.speed[order]
+        self.depth = self.depth[order]
+        self.image_index = self.image_index[order]
+        self.image_size = image_sizes[self.image_index]
+        self.cloud_images = [self.images[i] for i in self.image_index]
+
+    def __len__(self):
+        return len(self.pos)
 
     def update(self):
-        for cloud in self.clouds:
-            cloud.update()
+        self.pos[:, 0] += self.speed
 
+    # surf can be a surface or a RenderQueue
     def render(self, surf, offset=(0, 0)):
-        for cloud in self.clouds:
-            cloud.render(surf, offset)
+        render_pos = self.pos - np.asarray(offset) * self.depth[:, None]
+        # modulo here to loop the image back around when it goes off screen
+        # add img size to modulo so there is a buffer before it loops
+        # subtracting the img size wraps the image around the edge of the screen
+        dests = render_pos % (np.array(surf.get_size()) +
+                              self.image_size) - self.image_size
+        # the wrap keeps every cloud at least partly on screen, so there is nothing to cull
+        surf.blits(zip(self.cloud_images, dests.tolist()), doreturn=False)
@@ -1,28 +1,22 @@
 import pygame
 import math
-import random
 import numpy as np
-from scripts.particle import Particle
-from scripts.spark import Spark
+from scripts.physics import CollisionFlags
 
 
 class PhysicsEntity:
+    # x velocity lost per frame
+    FRICTION = 0.
 
     def __init__(self, game, e_type, pos, size):
         self.game = game
         self.type = e_type
-        # want list here so that if we spawn multiple entities at the same position they don't have the same reference to the position
-        # also incase we pass a tuple
-        # can also use pygama.math.Vector2 instead
-        self.pos = np.array(pos)
+        # position, velocity and collisions live in the world's PhysicsBodies arrays
+        # so every entity can be moved in one batched call, the entity only keeps its slot
+        self.bodies = game.bodies
+        self.slot = self.bodies.add(self, pos, size, friction=self.FRICTION)
         self.size = size
-        self.velocity = np.array([0., 0.])
-        self.collisions = {
-            'left': False,
-            'right': False,
-            'up': False,
-            'down': False
-        }
+        self.collisions = CollisionFlags(self)
 
         self.action = ''
         # padding because the images are slightly larger than the hitbox
@@ -45,71 +39,61 @@ class PhysicsEntity:
     def set_flip(self, flip):
         self.flip = flip
 
-    def update(self, tilemap, movement=np.array((0, 0))):
-        self.collisions = {
-            'left': False,
-            'right': False,
-            'up': False,
-            'down': False
-        }
-
-        frame_movement = np.float16(movement) + self.velocity
-
-        self.pos[0] += frame_movement[0]
-        entity_rect = self.rect()
-        for rect in tilemap.physics_rects_around(self.pos):
-            if entity_rect.colliderect(rect):
-                if frame_movement[0] > 0:
-                    entity_rect.right = rect.left
-                    self.collisions['right'] = True
-                if frame_movement[0] < 0:
-                    entity_rect.left = rect.right
-                    self.collisions['left'] = True
-
-                # why not use Rect for physical entity instead of position?
-                # because Rect only allows integer values so movement += 0.5 has no effect
-                # can use pygame-ce's FRECT instead, which allows float values
-                self.pos[0] = entity_rect.x
-
-        self.pos[1] += frame_movement[1]
-        entity_rect = self.rect()
-        for rect in tilemap.physics_rects_around(self.pos):
-            if entity_rect.colliderect(rect):
-                if frame_movement[1] > 0:
-                    entity_rect.bottom = rect.top
-                    self.collisions['down'] = True
-                if frame_movement[1] < 0:
-                    entity_rect.top = rect.bottom
-                    self.collisions['up'] = True
-                self.pos[1] = entity_rect.y
+    # row views into the bodies arrays, writes go straight to the arrays
+    @property
+    def pos(self):
+        return self.bodies.pos[self.slot]
 
+    @pos.setter
+    def pos(self, pos):
+        self.bodies.pos[self.slot] = pos
+
+    @property
+    def velocity(self):
+        return self.bodies.velocity[self.slot]
+
+    @velocity.setter
+    def velocity(self, velocity):
+        self.bodies.velocity[self.slot] = velocity
+
+    # take the entity out of the bodies arrays when it is removed from the world
+    def despawn(self):
+        self.bodies.remove(self.slot)
+
+    # movement the entity wants for this frame
+    def think(self, tilemap, movement=(0, 0)):
+        return movement
+
+    # everything that reacts to the result of the move
+    def after_move(self, tilemap, movement):
         if movement[0] < 0:
             self.flip = True
         elif movement[0] > 0:
             self.flip = False
         self.last_movement = movement
 
-        # gravity and terminal velocity
-        self.velocity[1] = min(5, self.velocity[1] + 0.1)
-
-        if self.collisions['down'] or self.collisions['up']:
-            self.velocity[1] = 0
-
         self.animation.update()
 
+    # step a single entity, the world steps all of them at once with the same calls
+    def update(self, tilemap, movement=(0, 0)):
+        movement = self.think(tilemap, movement)
+        self.bodies.move_and_collide(tilemap, [self.slot], [movement])
+        result = self.after_move(tilemap, movement)
+        self.bodies.apply_friction([self.slot])
+        return result
+
     def render(self, surf, offset=np.array((0, 0))):
-        # decide if we want to flip image before rendering it
-        # flip(img, h_flip, v_flip)
-        surf.blit(
-            pygame.transform.flip(self.animation.img(), self.flip, False),
-            (self.pos[0] - offset[0] + self.anim_offset[0],
-             self.pos[1] - offset[1] + self.anim_offset[1]))
+        # the animation has the flipped frames ready, nothing is flipped here
+        surf.blit(self.animation.img(self.flip),
+                  (self.pos[0] - offset[0] + self.anim_offset[0],
+                   self.pos[1] - offset[1] + self.anim_offset[1]))
 
         # surf.blit(self.game.assets['player'],
         #           (self.pos[0] - offset[0], self.pos[1] - offset[1]))
 
 
 class Player(PhysicsEntity):
+    FRICTION = 0.1
 
     def __init__(self, game, pos, size):
         super().__init__(game, 'player', pos, size)
@@ -119,8 +103,8 @@ class Player(PhysicsEntity):
         self.wall_slide = False
         self.dashing = 0
 
-    def update(self, tilemap, movement=(0, 0)):
-        super().update(tilemap, movement)
+    def after_move(self, tilemap, movement):
+        super().after_move(tilemap, movement)
 
         self.air_time += 1
 
@@ -151,16 +135,10 @@ class Player(PhysicsEntity):
                 self.set_action('idle')
 
         if abs(self.dashing) in {60, 50}:
-            for i in range(20):
-                speed = random.random() * 0.5 + 0.5
-                angle = random.random() * math.pi * 2
-                pvelocity = [math.cos(angle) * speed, math.sin(angle) * speed]
-                self.game.particles.append(
-                    Particle(self.game,
-                             'particle',
-                             self.rect().center,
-                             velocity=pvelocity,
-                             frame=random.randint(0, 7)))
+            self.game.emit_burst('particle',
+                                 self.rect().center,
+                                 20, (0.5, 1),
+                                 frame_range=(0, 7))
         if self.dashing > 0:
             self.dashing = max(0, self.dashing - 1)
         elif self.dashing < 0:
@@ -169,21 +147,12 @@ class Player(PhysicsEntity):
             self.velocity[0] = 8 * abs(self.dashing) / self.dashing
             if abs(self.dashing) == 51:
                 self.velocity[0] *= 0.1
-            pvelocity = [
-                3 * random.random() * abs(self.dashing) / self.dashing, 0
-            ]
-            self.game.particles.append(
-                Particle(self.game,
-                         'particle',
-                         self.rect().center,
-                         velocity=pvelocity,
-                         frame=random.randint(0, 7)))
-
-        # friction in x axis
-        if self.velocity[0] > 0:
-            self.velocity[0] = max(self.velocity[0] - 0.1, 0)
-        elif self.velocity[0] < 0:
-            self.velocity[0] = min(self.velocity[0] + 0.1, 0)
+            # trail of dust behind the dash
+            angle = 0 if self.dashing > 0 else math.pi
+            self.game.emit_burst('particle',
+                                 self.rect().center,
+                                 1, (0, 3), (angle, angle),
+                                 frame_range=(0, 7))
 
     # do not render player for first 10 frames of dash animation
     def render(self, surf, offset=np.array((0, 0))):
@@ -224,7 +193,7 @@ class Enemy(PhysicsEntity):
         super().__init__(game, 'enemy', pos, size)
         self.walking = 0
 
-    def update(self, tilemap, movement=(0, 0)):
+    def think(self, tilemap, movement=(0, 0)):
         if self.walking:
             tile_ahead = tilemap.solid_check(
                 (self.rect().centerx + (-7 if self.flip else 7),
@@ -239,71 +208,49 @@ class Enemy(PhysicsEntity):
             # spawn projectile when enemy stops
             if not self.walking:
                 dis = self.game.player.pos - self.pos
-                if (abs(dis[1]) < 16):
+                # only shoot when no wall is between the gun and the player
+                if abs(dis[1]) < 16 and not tilemap.raycast(
+                        self.rect().center,
+                        self.game.player.rect().center):
                     if self.flip and dis[0] < 0:
-                        self.game.projectiles.append(
-                            [[self.rect().centerx - 7,
-                              self.rect().centery], -1.5, 0])
-                        for _ in range(4):
-                            self.game.sparks.append(
-                                Spark(self.game.projectiles[-1][0],
-                                      random.random() - 0.5 + math.pi,
-                                      2 + random.random()))
+                        muzzle = (self.rect().centerx - 7, self.rect().centery)
+                        self.game.projectiles.add(muzzle, -1.5)
+                        self.game.emit_burst('spark', muzzle, 4, (2, 3),
+                                             (math.pi - 0.5, math.pi + 0.5))
                     if not self.flip and dis[0] > 0:
-                        self.game.projectiles.append(
-                            [[self.rect().centerx + 7,
-                              self.rect().centery], 1.5, 0])
-                        for _ in range(4):
-                            self.game.sparks.append(
-                                Spark(self.game.projectiles[-1][0],
-                                      random.random() - 0.5,
-                                      2 + random.random()))
+                        muzzle = (self.rect().centerx + 7, self.rect().centery)
+                        self.game.projectiles.add(muzzle, 1.5)
+                        self.game.emit_burst('spark', muzzle, 4, (2, 3),
+                                             (-0.5, 0.5))
         # walk randomly every 6-7 seconds
-        elif random.random() < 0.01:
-            self.walking = random.randint(30, 120)
+        elif self.game.random.random() < 0.01:
+            self.walking = self.game.random.randint(30, 120)
+        return movement
 
-        super().update(tilemap, movement=movement)
+    def after_move(self, tilemap, movement):
+        super().after_move(tilemap, movement)
 
         if movement[0] != 0:
             self.set_action('run')
         else:
             self.set_action('idle')
 
-        # kill enemy if player collides while in initial frames of dashing
-        if abs(self.game.player.dashing) >= 50:
-            if self.rect().colliderect(self.game.player.rect()):
-                for _ in range(30):
-                    angle = random.random() * 2 * math.pi
-                    speed = random.random() * 5
-                    self.game.sparks.append(
-                        Spark(self.rect().center, angle, 2 + random.random()))
-                    self.game.particles.append(
-                        Particle(
-                            self.game,
-                            'particle',
-                            self.rect().center,
-                            velocity=[
-                                math.cos(math.pi + angle) * speed * 0.5,
-                                math.sin(math.pi + angle) * speed * 0.5
-                            ],
-                            frame=random.randint(0, 7),
-                        ))
-                self.game.sparks.append(
-                    Spark(self.rect().center, 0, 5 + random.random()))
-                self.game.sparks.append(
-                    Spark(self.rect().center, math.pi, 5 + random.random()))
-                return True
+    # vfx for the enemy getting killed by the player's dash
+    # the world finds the hit through its broadphase and removes the enemy
+    def die(self):
+        center = self.rect().center
+        self.game.death_burst(center)
+        self.game.emit_burst('spark', center, 1, (5, 6), (0, 0))
+        self.game.emit_burst('spark', center, 1, (5, 6), (math.pi, math.pi))
 
     # render gun
     def render(self, surf, offset=np.array((0, 0))):
         super().render(surf, offset=offset)
+        center = self.rect().center
         if self.flip:
-            surf.blit(
-                pygame.transform.flip(self.game.assets['gun'], True, False),
-                (self.rect().centerx -
-                 4 - self.game.assets['gun'].get_width() - offset[0],
-                 self.rect().centery - offset[1]))
+            gun = self.game.assets['gun_flipped']
+            surf.blit(gun, (center[0] - 4 - gun.get_width() - offset[0],
+                            center[1] - offset[1]))
         else:
             surf.blit(self.game.assets['gun'],
-                      (self.rect().centerx + 4 - offset[0],
-                       self.rect().centery - offset[1]))
+                      (center[0] + 4 - offset[0], center[1] - offset[1]))
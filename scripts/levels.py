@@ -0,0 +1,148 @@
+import json
+import os
+import queue
+from concurrent.futures import ThreadPoolExecutor
+import pygame
+from scripts.mapfile import is_binary_path, read_map
+from scripts.tilemap import Tilemap
+
+MAPS_PATH = 'data/maps/'
+# progress reported once the file is read, building the level takes the rest
+READ_PROGRESS = 0.5
+READ_BLOCK_SIZE = 64 * 1024
+
+
+# how a level starts: its tiles with the spawners taken out, where the player and enemies spawn
+# and the leaf spawner rects, tiles is None for streamed levels
+class LevelSnapshot:
+
+    def __init__(self, tiles, player_pos, enemy_positions, leaf_spawners):
+        self.tiles = tiles
+        self.player_pos = player_pos
+        self.enemy_positions = enemy_positions
+        self.leaf_spawners = leaf_spawners
+
+
+# take the spawners out of a freshly loaded tilemap and snapshot what is left
+def capture_level(tilemap):
+    # spawn leaf particles from trees
+    leaf_spawners = []
+    for tree in tilemap.extract([('large_decor', 2)], keep=True):
+        leaf_spawners.append(
+            pygame.Rect(4 + tree['pos'][0], 4 + tree['pos'][1], 23, 13))
+
+    player_pos = None
+    enemy_positions = []
+    for spawner in tilemap.extract([('spawners', 0), ('spawners', 1)]):
+        if spawner['variant'] == 0:
+            player_pos = spawner['pos']
+        else:
+            enemy_positions.append(spawner['pos'])
+
+    tiles = None if tilemap.streaming else tilemap.snapshot()
+    return LevelSnapshot(tiles, player_pos, enemy_positions, leaf_spawners)
+
+
+def level_path(map_id, maps_path=MAPS_PATH):
+    return maps_path + str(map_id) + '.json'
+
+
+def level_count(maps_path=MAPS_PATH):
+    return len(
+        [name for name in os.listdir(maps_path) if name.endswith('.json')])
+
+
+# read a file in blocks, calling progress(fraction read) after each one
+def read_file(path, progress=None):
+    size = max(os.path.getsize(path), 1)
+    blocks = []
+    read = 0
+    with open(path, 'rb') as f:
+        while True:
+            block = f.read(READ_BLOCK_SIZE)
+            if not block:
+                break
+            blocks.append(block)
+            read += len(block)
+            if progress is not None:
+                progress(min(read / size, 1.) * READ_PROGRESS)
+    return b''.join(blocks)
+
+
+# read, parse and snapshot a level without touching any world, so it can run on a worker thread
+# the level is built in a scratch tilemap, restoring the snapshot puts it into the world's
+def read_level(path, progress=None):
+    if is_binary_path(path):
+        map_data = read_map(path)
+    else:
+        map_data = json.loads(read_file(path, progress))
+    if progress is not None:
+        progress(READ_PROGRESS)
+    tilemap = Tilemap(None)
+    tilemap.use_map_data(map_data)
+    level = capture_level(tilemap)
+    if progress is not None:
+        progress(1.)
+    return level
+
+
+# reads and builds levels on a worker thread so loading one never stalls a frame
+# progress and finished levels are handed back on the thread calling poll, normally the game loop,
+# through on_progress(map_id, fraction) and on_complete(map_id, level) when they are set
+class LevelLoader:
+
+    def __init__(self, on_progress=None, on_complete=None):
+        self.on_progress = on_progress
+        self.on_complete = on_complete
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        # map id -> future of its LevelSnapshot
+        self.pending = {}
+        # (map id, fraction) sent by the worker, drained by poll
+        self.updates = queue.SimpleQueue()
+        # map id -> last reported progress of every load in flight
+        self.progress = {}
+
+    # start reading a level in the background unless it is already on its way
+    def prefetch(self, map_id, path=None):
+        if map_id in self.pending:
+            return
+        self.progress[map_id] = 0.
+        self.pending[map_id] = self.executor.submit(
+            read_level, path or level_path(map_id),
+            lambda fraction: self.updates.put((map_id, fraction)))
+
+    def loading(self, map_id):
+        return map_id in self.pending
+
+    # report progress and return [(map_id, level)] of the loads that finished since the last poll
+    # failed loads stay pending so take raises their error when the level is needed
+    def poll(self):
+        # futures are checked before the updates are drained so a finished load's last update isn't lost
+        finished = [
+            map_id for map_id, future in self.pending.items()
+            if future.done() and future.exception() is None
+        ]
+        while True:
+            try:
+                map_id, fraction = self.updates.get_nowait()
+            except queue.Empty:
+                break
+            if map_id in self.progress:
+                self.progress[map_id] = fraction
+                if self.on_progress is not None:
+                    self.on_progress(map_id, fraction)
+        return [(map_id, self.take(map_id)) for map_id in finished]
+
+    # the level of a prefetch, waits for the worker if it isn't done yet
+    def take(self, map_id):
+        future = self.pending.pop(map_id)
+        self.progress.pop(map_id, None)
+        level = future.result()
+        if self.on_complete is not None:
+            self.on_complete(map_id, level)
+        return level
+
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.pending = {}
+        self.progress = {}
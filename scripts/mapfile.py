@@ -0,0 +1,235 @@
+import os
+import sys
+import struct
+from collections.abc import Mapping
+import numpy as np
+
+# binary map layout, all little endian:
+#   header      MAGIC, version, tile_size, chunk_size, palette_count, chunk_count, offgrid_count,
+#               and the byte offsets of the sections below
+#   palette     palette_count tile type names, each a u8 length followed by utf-8 bytes
+#               a type's id is its index in the palette + 1, 0 marks an empty cell
+#   chunk table chunk_count (x, y) int32 chunk positions
+#   chunk data  per chunk a chunk_size x chunk_size u8 array of type ids then one of variants
+#   offgrid     offgrid_count records of type id, variant and pixel position
+MAGIC = b'TMAP'
+VERSION = 1
+BINARY_EXTENSION = '.tmap'
+
+HEADER = struct.Struct('<4sHHHHIIIIII')
+CHUNK_TABLE_DTYPE = np.dtype([('x', '<i4'), ('y', '<i4')])
+OFFGRID_DTYPE = np.dtype([('type', '<u2'), ('variant', '<u2'), ('x', '<f4'),
+                          ('y', '<f4')])
+
+
+def is_binary_path(path):
+    return str(path).endswith(BINARY_EXTENSION)
+
+
+# write a map given the palette (list of type names, id 1 first),
+# chunks as {(x, y): (types, variants)} and offgrid tiles as dicts
+def write_map(path, tile_size, chunk_size, palette, chunks, offgrid):
+    type_ids = {tile_type: i + 1 for i, tile_type in enumerate(palette)}
+    palette_bytes = b''.join(
+        bytes([len(name)]) + name
+        for name in (tile_type.encode('utf-8') for tile_type in palette))
+
+    keys = sorted(chunks)
+    table = np.array(keys, dtype=CHUNK_TABLE_DTYPE)
+    data = np.zeros((len(keys), 2, chunk_size, chunk_size), dtype=np.uint8)
+    for i, key in enumerate(keys):
+        data[i, 0], data[i, 1] = chunks[key]
+
+    records = np.zeros(len(offgrid), dtype=OFFGRID_DTYPE)
+    for i, tile in enumerate(offgrid):
+        records[i] = (type_ids[tile['type']], tile['variant'], tile['pos'][0],
+                      tile['pos'][1])
+
+    palette_offset = HEADER.size
+    table_offset = palette_offset + len(palette_bytes)
+    data_offset = table_offset + table.nbytes
+    offgrid_offset = data_offset + data.nbytes
+    # write next to the target and swap it in, a loaded map may still be mapped from the old file
+    tmp_path = str(path) + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(
+            HEADER.pack(MAGIC, VERSION, tile_size, chunk_size, len(palette),
+                        len(keys), len(offgrid), palette_offset, table_offset,
+                        data_offset, offgrid_offset))
+        f.write(palette_bytes)
+        f.write(table.tobytes())
+        f.write(data.tobytes())
+        f.write(records.tobytes())
+    os.replace(tmp_path, path)
+
+
+# chunk positions packed into one int64 each so they sort and binary search as single keys
+def pack_chunk_keys(xs, ys):
+    return (np.asarray(xs, dtype=np.int64) << 32) + (
+        np.asarray(ys, dtype=np.int64) + (1 << 31))
+
+
+# read only {(x, y): (types, variants)} over the chunk table of a mapped file
+# opening a map only sorts the packed table keys, the views into the file
+# are made when a chunk is looked up
+class MapChunks(Mapping):
+
+    def __init__(self, table, data):
+        self.table = table
+        self.data = data
+        keys = pack_chunk_keys(table['x'], table['y'])
+        # write_map sorts the table, other writers need the order to find the rows
+        if np.all(keys[:-1] < keys[1:]):
+            self.order = None
+            self.keys = keys
+        else:
+            self.order = np.argsort(keys, kind='stable')
+            self.keys = keys[self.order]
+
+    # row of a chunk in the file, None when the file doesn't have it
+    def index(self, key):
+        packed = (key[0] << 32) + key[1] + (1 << 31)
+        i = int(np.searchsorted(self.keys, packed))
+        if i == len(self.keys) or self.keys[i] != packed:
+            return None
+        return i if self.order is None else int(self.order[i])
+
+    def __getitem__(self, key):
+        i = self.index(key)
+        if i is None:
+            raise KeyError(key)
+        return self.data[i, 0], self.data[i, 1]
+
+    def __contains__(self, key):
+        return self.index(key) is not None
+
+    def __iter__(self):
+        return iter(self.table.tolist())
+
+    def __len__(self):
+        return len(self.table)
+
+    # keys of the chunks with cells of a type id and variant, in file order
+    def find(self, t_id, variant):
+        rows = np.nonzero(((self.data[:, 0] == t_id) &
+                           (self.data[:, 1] == variant)).any(axis=(1, 2)))[0]
+        return [tuple(key) for key in self.table[rows].tolist()]
+
+    # every chunk in file order without searching for each one, for loading a whole map
+    def items(self):
+        for i, key in enumerate(self.table.tolist()):
+            yield key, (self.data[i, 0], self.data[i, 1])
+
+
+# the offgrid records of a mapped file, found by the chunk their position falls in
+# records stay in the file until tiles() turns them into tile dicts
+class MapOffgrid:
+
+    def __init__(self, records, palette, chunk_pixels):
+        self.records = records
+        self.palette = palette
+        self.chunk_pixels = chunk_pixels
+        keys = pack_chunk_keys(*self.chunk_positions())
+        # stable so the records of a chunk stay in file order
+        self.order = np.argsort(keys, kind='stable')
+        self.keys = keys[self.order]
+        # records taken out of the map since it was read, see Tilemap.extract
+        self.removed = np.zeros(len(records), dtype=bool)
+
+    def __len__(self):
+        return len(self.records)
+
+    # chunk x and y of the records at indices, all records when indices is None
+    def chunk_positions(self, indices=None):
+        records = self.records if indices is None else self.records[indices]
+        return (np.floor(records['x'].astype(np.float64) /
+                         self.chunk_pixels).astype(np.int64),
+                np.floor(records['y'].astype(np.float64) /
+                         self.chunk_pixels).astype(np.int64))
+
+    # indices of the records in a chunk that weren't removed, in file order
+    def in_chunk(self, key):
+        packed = (key[0] << 32) + key[1] + (1 << 31)
+        start, end = np.searchsorted(self.keys, [packed, packed + 1])
+        indices = self.order[start:end]
+        return indices[~self.removed[indices]]
+
+    # indices of the records matching any of the (type, variant) pairs that weren't removed
+    def with_ids(self, id_pairs):
+        type_ids = {
+            tile_type: i + 1
+            for i, tile_type in enumerate(self.palette)
+        }
+        mask = np.zeros(len(self.records), dtype=bool)
+        for tile_type, variant in set(id_pairs):
+            if tile_type in type_ids:
+                mask |= ((self.records['type'] == type_ids[tile_type]) &
+                         (self.records['variant'] == variant))
+        return np.nonzero(mask & ~self.removed)[0]
+
+    # tile dicts of the records at indices, all records when indices is None
+    def tiles(self, indices=None):
+        records = self.records if indices is None else self.records[indices]
+        return [{
+            'type': self.palette[t_id - 1],
+            'variant': variant,
+            'pos': [x, y]
+        } for t_id, variant, x, y in records.tolist()]
+
+
+# map a binary map into memory, chunk arrays are copy-on-write views of the file
+# so opening a level doesn't copy the tile data until a chunk is edited
+# chunks and offgrid records are looked up in the file, see MapChunks and MapOffgrid
+def read_map(path):
+    mm = np.memmap(path, dtype=np.uint8, mode='c')
+    if len(mm) < HEADER.size:
+        raise ValueError(str(path) + ' is not a binary map')
+    (magic, version, tile_size, chunk_size, palette_count, chunk_count,
+     offgrid_count, palette_offset, table_offset, data_offset,
+     offgrid_offset) = HEADER.unpack_from(mm)
+    if magic != MAGIC:
+        raise ValueError(str(path) + ' is not a binary map')
+    if version > VERSION:
+        raise ValueError('unsupported binary map version ' + str(version))
+
+    palette = []
+    offset = palette_offset
+    for _ in range(palette_count):
+        length = int(mm[offset])
+        palette.append(
+            bytes(mm[offset + 1:offset + 1 + length]).decode('utf-8'))
+        offset += 1 + length
+
+    table = mm[table_offset:table_offset + chunk_count *
+               CHUNK_TABLE_DTYPE.itemsize].view(CHUNK_TABLE_DTYPE)
+    data = mm[data_offset:data_offset +
+              chunk_count * 2 * chunk_size * chunk_size].reshape(
+                  chunk_count, 2, chunk_size, chunk_size)
+    records = mm[offgrid_offset:offgrid_offset +
+                 offgrid_count * OFFGRID_DTYPE.itemsize].view(OFFGRID_DTYPE)
+
+    return {
+        'tile_size': tile_size,
+        'chunk_size': chunk_size,
+        'palette': palette,
+        'chunks': MapChunks(table, data),
+        'offgrid': MapOffgrid(records, palette, tile_size * chunk_size)
+    }
+
+
+def convert(src, dst):
+    # import here because the tilemap imports this module
+    import asyncio
+    from scripts.tilemap import Tilemap
+    tilemap = Tilemap(None)
+    asyncio.run(tilemap.load(src))
+    tilemap.save(dst)
+
+
+# convert between formats based on the file extensions:
+# python -m scripts.mapfile data/maps/0.json data/maps/0.tmap
+if __name__ == '__main__':
+    if len(sys.argv) != 3:
+        print('usage: python -m scripts.mapfile <src> <dst>')
+        sys.exit(1)
+    convert(sys.argv[1], sys.argv[2])
@@ -1,27 +1,116 @@
-class Particle:
+import numpy as np
 
-    def __init__(self, game, p_type, pos, velocity=[0, 0], frame=0):
-        self.game = game
-        self.type = p_type
-        self.pos = list(pos)
-        self.velocity = list(velocity)
-        self.animation = self.game.assets['particle/' + p_type].copy()
-        self.animation.frame = frame
+# how far leaves drift sideways, other kinds don't sway
+SWAY = {'leaf': 0.3}
+
+
+# drop the given slots from pool arrays whose live entries are packed in the first count slots
+# live entries past the new end move into the dead slots below it, returns the new count
+def swap_remove(arrays, count, slots):
+    n = count - len(slots)
+    holes = slots[slots < n]
+    tail = np.arange(n, count)
+    movers = tail[~np.isin(tail, slots)]
+    for array in arrays:
+        array[holes] = array[movers]
+    return n
+
+
+# every particle in the world in preallocated arrays, so spawning and updating allocates nothing
+# live particles are packed in the first count slots, a dead particle is replaced by the last one
+class ParticleSystem:
+
+    def __init__(self, assets, kinds=('leaf', 'particle'), capacity=4096):
+        self.kinds = list(kinds)
+        self.kind_ids = {kind: i for i, kind in enumerate(self.kinds)}
+        # per kind tables, read from the same animations the Particle objects copied
+        animations = [assets['particle/' + kind] for kind in self.kinds]
+        self.images = [animation.images for animation in animations]
+        self.img_duration = np.array(
+            [animation.img_duration for animation in animations])
+        # particles die on the update after their animation reaches this frame
+        self.last_frame = np.array([
+            animation.img_duration * len(animation.images) - 1
+            for animation in animations
+        ])
+        self.sway = np.array([SWAY.get(kind, 0.) for kind in self.kinds])
+        # half image sizes for centering, all frames of a kind are the same size
+        self.half_size = [(images[0].get_width() // 2,
+                           images[0].get_height() // 2)
+                          for images in self.images]
+
+        self.capacity = capacity
+        self.count = 0
+        self.pos = np.zeros((capacity, 2))
+        self.velocity = np.zeros((capacity, 2))
+        self.frame = np.zeros(capacity, dtype=np.int32)
+        self.kind = np.zeros(capacity, dtype=np.uint8)
+
+    def __len__(self):
+        return self.count
+
+    def clear(self):
+        self.count = 0
+
+    # returns False when the pool is full and the particle was dropped
+    def add(self, kind, pos, velocity=(0, 0), frame=0):
+        if self.count == self.capacity:
+            return False
+        i = self.count
+        self.pos[i] = pos
+        self.velocity[i] = velocity
+        self.frame[i] = frame
+        self.kind[i] = self.kind_ids[kind]
+        self.count += 1
+        return True
+
+    # spawn many particles of one kind at once, pos, velocity and frame are arrays or broadcast
+    # returns how many fit in the pool, the rest are dropped
+    def add_many(self, kind, pos, velocity, frame):
+        count = min(len(velocity), self.capacity - self.count)
+        new = slice(self.count, self.count + count)
+        self.pos[new] = np.broadcast_to(pos, (len(velocity), 2))[:count]
+        self.velocity[new] = velocity[:count]
+        self.frame[new] = np.broadcast_to(frame, len(velocity))[:count]
+        self.kind[new] = self.kind_ids[kind]
+        self.count += count
+        return count
 
     def update(self):
-        kill = False
-        if self.animation.done:
-            kill = True
+        n = self.count
+        if not n:
+            return
+        pos = self.pos[:n]
+        frame = self.frame[:n]
+        kind = self.kind[:n]
 
-        self.pos[0] += self.velocity[0]
-        self.pos[1] += self.velocity[1]
+        last_frame = self.last_frame[kind]
+        kill = frame >= last_frame
+        pos += self.velocity[:n]
+        np.minimum(frame + 1, last_frame, out=frame)
+        # add a sway to the leaves
+        pos[:, 0] += np.sin(frame * 0.035) * self.sway[kind]
 
-        self.animation.update()
+        if kill.any():
+            self.remove(np.flatnonzero(kill))
 
-        return kill
+    # swap dead slots with live ones from the end so the live particles stay packed
+    def remove(self, slots):
+        self.count = swap_remove(
+            [self.pos, self.velocity, self.frame, self.kind], self.count,
+            slots)
 
     def render(self, surf, offset=(0, 0)):
-        img = self.animation.img()
-        # subtract width and height here to center particles based on center of image instead of top left
-        surf.blit(img, (self.pos[0] - offset[0] - img.get_width() // 2,
-                        self.pos[1] - offset[1] - img.get_height() // 2))
+        n = self.count
+        if not n:
+            return
+        kind = self.kind[:n]
+        image_index = self.frame[:n] // self.img_duration[kind]
+        # subtract half the image size to center particles on their position
+        xs = (self.pos[:n, 0] - offset[0]).tolist()
+        ys = (self.pos[:n, 1] - offset[1]).tolist()
+        blits = []
+        for x, y, k, i in zip(xs, ys, kind.tolist(), image_index.tolist()):
+            half_w, half_h = self.half_size[k]
+            blits.append((self.images[k][i], (x - half_w, y - half_h)))
+        surf.blits(blits, doreturn=False)
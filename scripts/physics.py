@@ -0,0 +1,149 @@
+import numpy as np
+
+# columns of PhysicsBodies.collisions
+LEFT, RIGHT, UP, DOWN = range(4)
+COLLISION_NAMES = {'left': LEFT, 'right': RIGHT, 'up': UP, 'down': DOWN}
+
+GRAVITY = 0.1
+TERMINAL_VELOCITY = 5
+
+
+# dict-like view of one entity's collision flags, read as entity.collisions['down']
+class CollisionFlags:
+
+    def __init__(self, entity):
+        self.entity = entity
+
+    def __getitem__(self, name):
+        entity = self.entity
+        return bool(entity.bodies.collisions[entity.slot,
+                                             COLLISION_NAMES[name]])
+
+    def keys(self):
+        return COLLISION_NAMES.keys()
+
+    def values(self):
+        return [self[name] for name in COLLISION_NAMES]
+
+    def items(self):
+        return [(name, self[name]) for name in COLLISION_NAMES]
+
+
+# structure of arrays holding the physics state of every PhysicsEntity
+# entities keep a slot index into the arrays, removing a body moves the last body into its slot
+class PhysicsBodies:
+
+    def __init__(self, capacity=64):
+        self.count = 0
+        self.pos = np.zeros((capacity, 2))
+        self.velocity = np.zeros((capacity, 2))
+        self.size = np.zeros((capacity, 2))
+        self.friction = np.zeros(capacity)
+        self.collisions = np.zeros((capacity, 4), dtype=bool)
+        # slot -> entity, so the moved entity can be told its new slot on removal
+        self.owners = []
+
+    def grow(self):
+        capacity = len(self.pos) * 2
+        for name in ['pos', 'velocity', 'size', 'friction', 'collisions']:
+            old = getattr(self, name)
+            new = np.zeros((capacity, ) + old.shape[1:], dtype=old.dtype)
+            new[:self.count] = old[:self.count]
+            setattr(self, name, new)
+
+    def add(self, entity, pos, size, friction=0.):
+        if self.count == len(self.pos):
+            self.grow()
+        slot = self.count
+        self.count += 1
+        self.pos[slot] = pos
+        self.velocity[slot] = 0
+        self.size[slot] = size
+        self.friction[slot] = friction
+        self.collisions[slot] = False
+        self.owners.append(entity)
+        return slot
+
+    def remove(self, slot):
+        last = self.count - 1
+        if slot != last:
+            for array in [
+                    self.pos, self.velocity, self.size, self.friction,
+                    self.collisions
+            ]:
+                array[slot] = array[last]
+            self.owners[slot] = self.owners[last]
+            self.owners[slot].slot = slot
+        self.owners.pop()
+        self.count = last
+
+    # move bodies by their velocity plus movement and push them out of solid tiles,
+    # one axis at a time, then apply gravity
+    # slots and movement are arrays so every entity is stepped at once
+    def move_and_collide(self, tilemap, slots, movement):
+        slots = np.asarray(slots, dtype=np.int64)
+        if not slots.size:
+            return
+        movement = np.asarray(movement, dtype=np.float64).reshape(-1, 2)
+        pos = self.pos[slots]
+        velocity = self.velocity[slots]
+        size = self.size[slots]
+        collisions = np.zeros((len(slots), 4), dtype=bool)
+
+        frame_movement = movement + velocity
+        pos[:, 0] += frame_movement[:, 0]
+        self.collide_axis(tilemap, pos, size, frame_movement, 0, collisions)
+        pos[:, 1] += frame_movement[:, 1]
+        self.collide_axis(tilemap, pos, size, frame_movement, 1, collisions)
+
+        # gravity and terminal velocity
+        velocity[:, 1] = np.minimum(TERMINAL_VELOCITY,
+                                    velocity[:, 1] + GRAVITY)
+        velocity[collisions[:, UP] | collisions[:, DOWN], 1] = 0
+
+        self.pos[slots] = pos
+        self.velocity[slots] = velocity
+        self.collisions[slots] = collisions
+
+    # resolve overlaps with solid tiles along one axis (0 = x, 1 = y)
+    def collide_axis(self, tilemap, pos, size, frame_movement, axis,
+                     collisions):
+        ts = tilemap.tile_size
+        # hitboxes are integer rects like pygame.Rect, which truncates float positions
+        rect = np.trunc(pos)
+        first = np.floor_divide(rect, ts).astype(np.int64)
+        last = np.floor_divide(rect + size - 1, ts).astype(np.int64)
+
+        # every tile each hitbox overlaps, padded to the largest hitbox
+        span = (last - first).max(axis=0) + 1
+        tile_xs = first[:, 0, None] + np.tile(np.arange(span[0]), span[1])
+        tile_ys = first[:, 1, None] + np.repeat(np.arange(span[1]), span[0])
+        inside = (tile_xs <= last[:, 0, None]) & (tile_ys <= last[:, 1, None])
+        solid = tilemap.solid_mask(tile_xs, tile_ys) & inside
+        hit = solid.any(axis=1)
+        if not hit.any():
+            return
+
+        # moving forward stops at the nearest solid tile ahead, moving back at the nearest behind
+        lines = tile_xs if axis == 0 else tile_ys
+        nearest_ahead = np.where(solid, lines,
+                                 np.iinfo(np.int64).max).min(axis=1)
+        nearest_behind = np.where(solid, lines,
+                                  np.iinfo(np.int64).min).max(axis=1)
+        forward = hit & (frame_movement[:, axis] > 0)
+        backward = hit & (frame_movement[:, axis] < 0)
+        resolved = rect[:, axis].copy()
+        resolved[forward] = nearest_ahead[forward] * ts - size[forward, axis]
+        resolved[backward] = (nearest_behind[backward] + 1) * ts
+        pos[hit, axis] = resolved[hit]
+        collisions[forward, RIGHT if axis == 0 else DOWN] = True
+        collisions[backward, LEFT if axis == 0 else UP] = True
+
+    # friction in x axis
+    def apply_friction(self, slots):
+        slots = np.asarray(slots, dtype=np.int64)
+        velocity = self.velocity[slots, 0]
+        friction = self.friction[slots]
+        self.velocity[slots, 0] = np.where(velocity > 0,
+                                           np.maximum(velocity - friction, 0),
+                                           np.minimum(velocity + friction, 0))
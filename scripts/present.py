@@ -0,0 +1,77 @@
+import queue
+import threading
+import pygame
+
+
+# scales finished frames up onto the window and shows them
+# the scale writes into preallocated surfaces, so presenting allocates nothing
+# in pipelined mode a worker thread scales frame N while the main thread simulates and draws frame N+1,
+# frames are drawn into two display surfaces in turn so the one being scaled is never drawn on
+# the window itself is only touched on the main thread, which shows frame N when frame N+1 is presented
+class Presenter:
+
+    def __init__(self, screen, display_size, pipelined=False):
+        self.screen = screen
+        self.pipelined = pipelined
+        self.displays = [
+            pygame.Surface(display_size) for _ in range(2 if pipelined else 1)
+        ]
+        self.index = 0
+
+        if pipelined:
+            # the worker scales into this, the main thread copies it to the window
+            self.scaled = pygame.Surface(screen.get_size(), 0, screen)
+            # true while a scaled frame hasn't been shown yet
+            self.pending = False
+            # holds at most the frame waiting to be scaled
+            self.frames = queue.Queue(maxsize=1)
+            # set while no frame is being presented
+            self.idle = threading.Event()
+            self.idle.set()
+            self.thread = threading.Thread(target=self.work, daemon=True)
+            self.thread.start()
+
+    # the surface the next frame should be drawn on
+    @property
+    def display(self):
+        return self.displays[self.index]
+
+    def show(self, display):
+        pygame.transform.scale(display, self.screen.get_size(), self.screen)
+        pygame.display.update()
+
+    def work(self):
+        while True:
+            display = self.frames.get()
+            if display is None:
+                break
+            pygame.transform.scale(display, self.scaled.get_size(),
+                                   self.scaled)
+            self.idle.set()
+
+    # put the frame the worker scaled last on the window, waits for the worker to finish it
+    def flip(self):
+        self.idle.wait()
+        if self.pending:
+            self.screen.blit(self.scaled, (0, 0))
+            pygame.display.update()
+            self.pending = False
+
+    # present the frame drawn on display, in pipelined mode this shows the previous frame
+    # and hands this one to the worker to scale
+    def present(self):
+        if not self.pipelined:
+            self.show(self.display)
+            return
+        self.flip()
+        self.idle.clear()
+        self.pending = True
+        self.frames.put(self.display)
+        self.index = 1 - self.index
+
+    # show the last frame and stop the worker, call before pygame.quit
+    def close(self):
+        if self.pipelined and self.thread.is_alive():
+            self.flip()
+            self.frames.put(None)
+            self.thread.join()
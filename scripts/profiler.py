@@ -0,0 +1,204 @@
+import csv
+import json
+import time
+import pygame
+from collections import deque
+import numpy as np
+
+
+# what scope() hands out while the profiler is off, entering and leaving it does nothing
+class NullScope:
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+NULL_SCOPE = NullScope()
+
+
+class Scope:
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        self.profiler.record(self.name, self.start, time.perf_counter_ns())
+        return False
+
+
+# named timing scopes and per frame counters, kept in ring buffers of the last history frames
+# while disabled scope() returns a shared no-op and count() returns straight away
+class Profiler:
+
+    def __init__(self, enabled=False, history=240, max_events=20000):
+        self.enabled = enabled
+        self.history = history
+        # name -> ring buffer of per frame values, scopes in milliseconds
+        self.timings = {}
+        self.counters = {}
+        # frames pushed so far, the ring position is frames % history
+        self.frames = 0
+        # totals of the frame in progress, a scope entered twice in a frame adds up
+        self.frame_timings = {}
+        self.frame_counters = {}
+        self.frame_start = None
+        # (name, start ns, end ns) of the most recent scopes, for the chrome trace
+        self.events = deque(maxlen=max_events)
+        self.origin = time.perf_counter_ns()
+        self.font = None
+        # the overlay is rebuilt every overlay_interval frames, not every frame
+        self.overlay_interval = 15
+        self.overlay = None
+        self.overlay_frame = None
+
+    def scope(self, name):
+        if not self.enabled:
+            return NULL_SCOPE
+        return Scope(self, name)
+
+    def record(self, name, start, end):
+        self.frame_timings[name] = self.frame_timings.get(name,
+                                                          0) + end - start
+        self.events.append((name, start, end))
+
+    def count(self, name, value):
+        if self.enabled:
+            self.frame_counters[name] = value
+
+    def begin_frame(self):
+        if self.enabled:
+            self.frame_start = time.perf_counter_ns()
+
+    # turning the profiler on or off mid frame drops that frame, its scopes only cover part of it
+    def toggle(self):
+        self.enabled = not self.enabled
+        self.reset_frame()
+
+    def reset_frame(self):
+        self.frame_timings.clear()
+        self.frame_counters.clear()
+        self.frame_start = None
+
+    # push the finished frame's totals into the ring buffers
+    # a frame that wasn't begun while enabled is dropped, so nothing it recorded leaks into the next one
+    def end_frame(self):
+        if not self.enabled or self.frame_start is None:
+            self.reset_frame()
+            return
+        self.record('frame', self.frame_start, time.perf_counter_ns())
+        slot = self.frames % self.history
+        for rings, values, scale in [(self.timings, self.frame_timings, 1e-6),
+                                     (self.counters, self.frame_counters, 1)]:
+            for name in values.keys() | rings.keys():
+                if name not in rings:
+                    rings[name] = np.full(self.history, np.nan)
+                rings[name][slot] = values.get(name, 0) * scale
+        self.reset_frame()
+        self.frames += 1
+
+    # values of the recorded frames, oldest first
+    def series(self, rings, name):
+        ring = rings[name]
+        if self.frames < self.history:
+            return ring[:self.frames]
+        slot = self.frames % self.history
+        return np.concatenate((ring[slot:], ring[:slot]))
+
+    # (p50, p99) of a scope in milliseconds over the recorded frames
+    def percentiles(self, name):
+        values = self.series(self.timings, name)
+        values = values[~np.isnan(values)]
+        if not len(values):
+            return (0., 0.)
+        p50, p99 = np.percentile(values, (50, 99))
+        return (float(p50), float(p99))
+
+    def stats(self):
+        return {
+            'timings': {
+                name: self.percentiles(name)
+                for name in self.timings
+            },
+            'counters': {
+                name:
+                float(np.nan_to_num(self.series(self.counters, name))[-1])
+                for name in self.counters if self.frames
+            },
+        }
+
+    # scope rows slowest first, then the counters of the last frame
+    def overlay_lines(self):
+        stats = self.stats()
+        lines = ['scope        p50    p99 ms']
+        for name, (p50, p99) in sorted(stats['timings'].items(),
+                                       key=lambda item: -item[1][1]):
+            lines.append('%-10s %6.2f %6.2f' % (name[:10], p50, p99))
+        for name, value in sorted(stats['counters'].items()):
+            lines.append('%-10s %6d' % (name[:10], value))
+        return lines
+
+    def render(self, surf, pos=(2, 2)):
+        if not self.enabled:
+            return
+        if (self.overlay is None
+                or self.frames - self.overlay_frame >= self.overlay_interval):
+            self.overlay = self.build_overlay()
+            self.overlay_frame = self.frames
+        surf.blit(self.overlay, pos)
+
+    def build_overlay(self):
+        if self.font is None:
+            pygame.font.init()
+            self.font = pygame.font.Font(None, 12)
+        texts = [
+            self.font.render(line, False, (255, 255, 255))
+            for line in self.overlay_lines()
+        ]
+        line_height = self.font.get_linesize()
+        panel = pygame.Surface(
+            (max(text.get_width()
+                 for text in texts) + 4, line_height * len(texts) + 2),
+            pygame.SRCALPHA)
+        panel.fill((0, 0, 0, 160))
+        for i, text in enumerate(texts):
+            panel.blit(text, (2, 1 + i * line_height))
+        return panel
+
+    # chrome://tracing / perfetto json of the most recent scopes
+    def export_chrome_trace(self, path):
+        trace = [{
+            'name': name,
+            'ph': 'X',
+            'ts': (start - self.origin) / 1000,
+            'dur': (end - start) / 1000,
+            'pid': 0,
+            'tid': 0,
+        } for name, start, end in self.events]
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': trace}, f)
+
+    # one row per recorded frame, a column per scope (ms) and per counter
+    def export_csv(self, path):
+        timing_names = sorted(self.timings)
+        counter_names = sorted(self.counters)
+        columns = (
+            [self.series(self.timings, name) for name in timing_names] +
+            [self.series(self.counters, name) for name in counter_names])
+        with open(path, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['frame'] +
+                            [name + '_ms'
+                             for name in timing_names] + counter_names)
+            first = self.frames - min(self.frames, self.history)
+            for i in range(min(self.frames, self.history)):
+                writer.writerow(
+                    [first + i] +
+                    [round(float(column[i]), 4) for column in columns])
@@ -0,0 +1,83 @@
+import numpy as np
+from scripts.particle import swap_remove
+
+# steps before a projectile that hit nothing disappears
+PROJECTILE_LIFETIME = 360
+
+
+# what happened to projectiles during one update, for the world to spawn vfx
+# hits on the player are found by the world through its broadphase
+class ProjectileEvents:
+
+    def __init__(self, wall_pos, wall_speed):
+        # where projectiles hit a wall and the x speed they were flying at
+        self.wall_pos = wall_pos
+        self.wall_speed = wall_speed
+
+
+# every enemy projectile in typed arrays, moved and resolved in one batched update
+# live projectiles are packed in the first count slots like the particle pool
+class ProjectileSystem:
+
+    def __init__(self, assets, capacity=1024):
+        self.img = assets['projectile']
+        self.capacity = capacity
+        self.count = 0
+        self.pos = np.zeros((capacity, 2))
+        # projectiles only fly horizontally
+        self.speed = np.zeros(capacity)
+        self.timer = np.zeros(capacity, dtype=np.int32)
+
+    def __len__(self):
+        return self.count
+
+    def clear(self):
+        self.count = 0
+
+    # returns False when the store is full and the projectile was dropped
+    def add(self, pos, speed):
+        if self.count == self.capacity:
+            return False
+        i = self.count
+        self.pos[i] = pos
+        self.speed[i] = speed
+        self.timer[i] = 0
+        self.count += 1
+        return True
+
+    # move every projectile, then drop the ones that hit a wall or timed out
+    def update(self, tilemap):
+        n = self.count
+        if not n:
+            return ProjectileEvents(np.zeros((0, 2)), np.zeros(0))
+        pos = self.pos[:n]
+        last_pos = pos.copy()
+        pos[:, 0] += self.speed[:n]
+        self.timer[:n] += 1
+
+        # sweep from the last position so fast projectiles can't pass through thin walls
+        wall_hit, hit_pos, _ = tilemap.raycast_many(last_pos, pos)
+        pos[wall_hit] = hit_pos[wall_hit]
+        timed_out = ~wall_hit & (self.timer[:n] > PROJECTILE_LIFETIME)
+        dead = wall_hit | timed_out
+
+        events = ProjectileEvents(pos[wall_hit].copy(),
+                                  self.speed[:n][wall_hit].copy())
+        if dead.any():
+            self.remove(np.flatnonzero(dead))
+        return events
+
+    # swap dead slots with live ones from the end so the live projectiles stay packed
+    def remove(self, slots):
+        self.count = swap_remove([self.pos, self.speed, self.timer],
+                                 self.count, slots)
+
+    def render(self, surf, offset=(0, 0)):
+        if not self.count:
+            return
+        # centered on the projectile position
+        xs = (self.pos[:self.count, 0] - self.img.get_width() / 2 -
+              offset[0]).tolist()
+        ys = (self.pos[:self.count, 1] - self.img.get_height() / 2 -
+              offset[1]).tolist()
+        surf.blits([(self.img, pos) for pos in zip(xs, ys)], doreturn=False)
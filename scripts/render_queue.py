@@ -0,0 +1,32 @@
+# collects the blits of a frame in draw order and submits them with one fblits call
+# it has the blit, blits and size methods the render functions use, so they can draw into it like a surface
+# anything drawn straight onto the target (like pygame.draw) needs a flush first to keep the order
+class RenderQueue:
+
+    def __init__(self, surf):
+        self.surf = surf
+        # (surface, dest) pairs
+        self.items = []
+        # blits submitted since the owner last reset it, for profiling
+        self.blit_count = 0
+
+    def get_size(self):
+        return self.surf.get_size()
+
+    def get_width(self):
+        return self.surf.get_width()
+
+    def get_height(self):
+        return self.surf.get_height()
+
+    def blit(self, img, dest):
+        self.items.append((img, dest))
+
+    def blits(self, blit_sequence, doreturn=False):
+        self.items.extend(blit_sequence)
+
+    def flush(self):
+        if self.items:
+            self.blit_count += len(self.items)
+            self.surf.fblits(self.items)
+            self.items = []
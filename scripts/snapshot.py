@@ -0,0 +1,282 @@
+from collections import deque
+import numpy as np
+from scripts.entities import Enemy
+
+# bump when a dtype below changes, older buffers are refused
+SNAPSHOT_VERSION = 1
+# actions an entity can be in, stored as an index
+ACTIONS = ('idle', 'run', 'jump', 'slide', 'wall_slide')
+ACTION_IDS = {action: i for i, action in enumerate(ACTIONS)}
+
+# everything that isn't per entity or per particle, the counts give the length of every section after it
+# random is the python random state (624 words and the position), rng_* the numpy PCG64 state
+HEADER_DTYPE = np.dtype([
+    ('version', '<u2'),
+    ('level', '<i4'),
+    ('dead', '<i4'),
+    ('transition', '<i4'),
+    ('scroll', '<f8', 2),
+    ('accumulator', '<f8'),
+    ('pending_jump', '?'),
+    ('pending_dash', '?'),
+    ('air_time', '<i4'),
+    ('jumps', '<i4'),
+    ('wall_slide', '?'),
+    ('dashing', '<i4'),
+    ('enemies', '<u4'),
+    ('projectiles', '<u4'),
+    ('particles', '<u4'),
+    ('sparks', '<u4'),
+    ('random', '<u4', 625),
+    ('rng_state', 'u1', 16),
+    ('rng_inc', 'u1', 16),
+    ('rng_has_uint32', '<i4'),
+    ('rng_uinteger', '<u4'),
+])
+# the player first, then the enemies in world order, walking is 0 for the player
+ENTITY_DTYPE = np.dtype([
+    ('pos', '<f8', 2),
+    ('velocity', '<f8', 2),
+    ('collisions', '?', 4),
+    ('flip', '?'),
+    ('action', 'u1'),
+    ('anim_frame', '<i4'),
+    ('anim_done', '?'),
+    ('last_movement', '<f8', 2),
+    ('walking', '<i4'),
+])
+PROJECTILE_DTYPE = np.dtype([
+    ('pos', '<f8', 2),
+    ('speed', '<f8'),
+    ('timer', '<i4'),
+])
+PARTICLE_DTYPE = np.dtype([
+    ('pos', '<f8', 2),
+    ('velocity', '<f8', 2),
+    ('frame', '<i4'),
+    ('kind', 'u1'),
+])
+SPARK_DTYPE = np.dtype([
+    ('pos', '<f8', 2),
+    ('angle', '<f8'),
+    ('speed', '<f8'),
+    ('direction', '<f8', 2),
+])
+
+
+# the full simulation state of a world as packed record arrays, no object graph
+# tobytes and from_bytes turn it into one contiguous buffer and back
+# the level's tiles are not in it, restoring loads the level from the level cache when it differs
+class WorldSnapshot:
+
+    def __init__(self, header, entities, projectiles, particles, sparks):
+        self.header = header
+        self.entities = entities
+        self.projectiles = projectiles
+        self.particles = particles
+        self.sparks = sparks
+
+    @property
+    def nbytes(self):
+        return sum(section.nbytes for section in self.sections())
+
+    def sections(self):
+        return [
+            self.header, self.entities, self.projectiles, self.particles,
+            self.sparks
+        ]
+
+    def tobytes(self):
+        return b''.join(section.tobytes() for section in self.sections())
+
+
+# the arrays are read only views into the buffer
+def from_bytes(buffer):
+    header = np.frombuffer(buffer, HEADER_DTYPE, 1)
+    if header['version'][0] != SNAPSHOT_VERSION:
+        raise ValueError('unsupported snapshot version ' +
+                         str(header['version'][0]))
+    offset = HEADER_DTYPE.itemsize
+    sections = [header]
+    for dtype, count in [(ENTITY_DTYPE, 1 + int(header['enemies'][0])),
+                         (PROJECTILE_DTYPE, int(header['projectiles'][0])),
+                         (PARTICLE_DTYPE, int(header['particles'][0])),
+                         (SPARK_DTYPE, int(header['sparks'][0]))]:
+        sections.append(np.frombuffer(buffer, dtype, count, offset))
+        offset += dtype.itemsize * count
+    return WorldSnapshot(*sections)
+
+
+def capture_world(world):
+    header = np.zeros(1, HEADER_DTYPE)
+    h = header[0]
+    h['version'] = SNAPSHOT_VERSION
+    h['level'] = world.level
+    h['dead'] = world.dead
+    h['transition'] = world.transition
+    h['scroll'] = world.scroll
+    h['accumulator'] = world.accumulator
+    h['pending_jump'] = world.pending_jump
+    h['pending_dash'] = world.pending_dash
+    player = world.player
+    h['air_time'] = player.air_time
+    h['jumps'] = player.jumps
+    h['wall_slide'] = player.wall_slide
+    h['dashing'] = player.dashing
+    h['enemies'] = len(world.enemies)
+    h['projectiles'] = world.projectiles.count
+    h['particles'] = world.particles.count
+    h['sparks'] = world.sparks.count
+    h['random'] = world.random.getstate()[1]
+    rng = world.rng.bit_generator.state
+    h['rng_state'] = np.frombuffer(
+        rng['state']['state'].to_bytes(16, 'little'), np.uint8)
+    h['rng_inc'] = np.frombuffer(rng['state']['inc'].to_bytes(16, 'little'),
+                                 np.uint8)
+    h['rng_has_uint32'] = rng['has_uint32']
+    h['rng_uinteger'] = rng['uinteger']
+
+    entities = [player] + world.enemies
+    slots = [entity.slot for entity in entities]
+    bodies = world.bodies
+    records = np.zeros(len(entities), ENTITY_DTYPE)
+    records['pos'] = bodies.pos[slots]
+    records['velocity'] = bodies.velocity[slots]
+    records['collisions'] = bodies.collisions[slots]
+    records['flip'] = [entity.flip for entity in entities]
+    records['action'] = [ACTION_IDS[entity.action] for entity in entities]
+    records['anim_frame'] = [entity.animation.frame for entity in entities]
+    records['anim_done'] = [entity.animation.done for entity in entities]
+    records['last_movement'] = [
+        entity.last_movement[:2] for entity in entities
+    ]
+    records['walking'] = [0] + [enemy.walking for enemy in world.enemies]
+
+    projectiles = world.projectiles
+    n = projectiles.count
+    projectile_records = np.zeros(n, PROJECTILE_DTYPE)
+    projectile_records['pos'] = projectiles.pos[:n]
+    projectile_records['speed'] = projectiles.speed[:n]
+    projectile_records['timer'] = projectiles.timer[:n]
+
+    particles = world.particles
+    n = particles.count
+    particle_records = np.zeros(n, PARTICLE_DTYPE)
+    particle_records['pos'] = particles.pos[:n]
+    particle_records['velocity'] = particles.velocity[:n]
+    particle_records['frame'] = particles.frame[:n]
+    particle_records['kind'] = particles.kind[:n]
+
+    sparks = world.sparks
+    n = sparks.count
+    spark_records = np.zeros(n, SPARK_DTYPE)
+    spark_records['pos'] = sparks.pos[:n]
+    spark_records['angle'] = sparks.angle[:n]
+    spark_records['speed'] = sparks.speed[:n]
+    spark_records['direction'] = sparks.direction[:n]
+
+    return WorldSnapshot(header, records, projectile_records, particle_records,
+                         spark_records)
+
+
+# put a world back into the state of a snapshot
+# enemy objects are reused, only the difference in count is spawned or despawned
+# a snapshot that doesn't fit the world's pools is refused before anything is changed
+def restore_world(world, snapshot):
+    pools = [
+        (world.projectiles, snapshot.projectiles, ('pos', 'speed', 'timer')),
+        (world.particles, snapshot.particles, ('pos', 'velocity', 'frame',
+                                               'kind')),
+        (world.sparks, snapshot.sparks, ('pos', 'angle', 'speed',
+                                         'direction')),
+    ]
+    for system, section, _ in pools:
+        if len(section) > system.capacity:
+            raise ValueError('snapshot has ' + str(len(section)) +
+                             ' entries, pool holds ' + str(system.capacity))
+
+    h = snapshot.header[0]
+    if int(h['level']) != world.level:
+        world.load_level(int(h['level']))
+    world.dead = int(h['dead'])
+    world.transition = int(h['transition'])
+    world.scroll[:] = h['scroll']
+    world.accumulator = float(h['accumulator'])
+    world.pending_jump = bool(h['pending_jump'])
+    world.pending_dash = bool(h['pending_dash'])
+    player = world.player
+    player.air_time = int(h['air_time'])
+    player.jumps = int(h['jumps'])
+    player.wall_slide = bool(h['wall_slide'])
+    player.dashing = int(h['dashing'])
+    random_state = h['random'].tolist()
+    world.random.setstate((3, tuple(random_state), None))
+    world.rng.bit_generator.state = {
+        'bit_generator': 'PCG64',
+        'state': {
+            'state': int.from_bytes(h['rng_state'].tobytes(), 'little'),
+            'inc': int.from_bytes(h['rng_inc'].tobytes(), 'little'),
+        },
+        'has_uint32': int(h['rng_has_uint32']),
+        'uinteger': int(h['rng_uinteger']),
+    }
+
+    enemy_count = int(h['enemies'])
+    while len(world.enemies) > enemy_count:
+        world.enemies.pop().despawn()
+    while len(world.enemies) < enemy_count:
+        world.enemies.append(Enemy(world, (0, 0), (8, 15)))
+
+    entities = [player] + world.enemies
+    records = snapshot.entities
+    slots = [entity.slot for entity in entities]
+    bodies = world.bodies
+    bodies.pos[slots] = records['pos']
+    bodies.velocity[slots] = records['velocity']
+    bodies.collisions[slots] = records['collisions']
+    for entity, flip, action, frame, done, movement in zip(
+            entities, records['flip'].tolist(), records['action'].tolist(),
+            records['anim_frame'].tolist(), records['anim_done'].tolist(),
+            records['last_movement'].tolist()):
+        entity.flip = flip
+        entity.set_action(ACTIONS[action])
+        entity.animation.frame = frame
+        entity.animation.done = done
+        entity.last_movement = movement
+    for enemy, walking in zip(world.enemies, records['walking'][1:].tolist()):
+        enemy.walking = walking
+
+    for system, section, names in pools:
+        n = len(section)
+        for name in names:
+            getattr(system, name)[:n] = section[name]
+        system.count = n
+
+    world.save_previous()
+
+
+# the snapshots of the last capacity frames, for rewinding and rollback
+class SnapshotRing:
+
+    def __init__(self, capacity=120):
+        self.snapshots = deque(maxlen=capacity)
+
+    def __len__(self):
+        return len(self.snapshots)
+
+    def clear(self):
+        self.snapshots.clear()
+
+    # the oldest snapshot drops out once the ring is full
+    def push(self, snapshot):
+        self.snapshots.append(snapshot)
+
+    # the snapshot frames_ago pushes back, 0 is the latest
+    def get(self, frames_ago=0):
+        return self.snapshots[-1 - frames_ago]
+
+    # drop the frames_ago newest snapshots and return the one that is latest after that
+    def rewind(self, frames_ago=1):
+        for _ in range(min(frames_ago, len(self.snapshots) - 1)):
+            self.snapshots.pop()
+        return self.snapshots[-1]
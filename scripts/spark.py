@@ -1,38 +1,81 @@
-import math
 import pygame
 import numpy as np
+from scripts.particle import swap_remove
 
 
-class Spark:
+# every spark in the world in preallocated arrays, updated and turned into polygons in one pass
+# live sparks are packed in the first count slots like the particle pool
+class SparkSystem:
 
-    def __init__(self, pos, angle, speed):  # can add size, decay
-        self.pos = np.array(pos)
-        self.angle = angle
-        self.speed = speed
+    def __init__(self, capacity=2048):
+        self.capacity = capacity
+        self.count = 0
+        self.pos = np.zeros((capacity, 2))
+        self.angle = np.zeros(capacity)
+        self.speed = np.zeros(capacity)
+        # unit vector of the angle, a spark never turns so this is computed once at spawn
+        self.direction = np.zeros((capacity, 2))
+
+    def __len__(self):
+        return self.count
+
+    def clear(self):
+        self.count = 0
+
+    # spawn sparks at pos (one position or one per spark), returns how many fit in the pool
+    def add_many(self, pos, angles, speeds):
+        angles = np.asarray(angles, dtype=np.float64)
+        count = min(len(angles), self.capacity - self.count)
+        new = slice(self.count, self.count + count)
+        angles = angles[:count]
+        pos = np.asarray(pos, dtype=np.float64)
+        self.pos[new] = pos[:count] if pos.ndim == 2 else pos
+        self.angle[new] = angles
+        self.speed[new] = np.asarray(speeds)[:count]
+        self.direction[new, 0] = np.cos(angles)
+        self.direction[new, 1] = np.sin(angles)
+        self.count += count
+        return count
+
+    def add(self, pos, angle, speed):
+        return self.add_many(pos, [angle], [speed])
 
     def update(self):
-        self.pos[0] += math.cos(self.angle) * self.speed
-        self.pos[1] += math.sin(self.angle) * self.speed
+        n = self.count
+        if not n:
+            return
+        speed = self.speed[:n]
+        self.pos[:n] += self.direction[:n] * speed[:, None]
+        np.maximum(speed - 0.1, 0, out=speed)
+
+        # sparks die once they stop, dead ones are removed in one go
+        dead = np.flatnonzero(speed == 0)
+        if len(dead):
+            self.count = swap_remove(
+                [self.pos, self.angle, self.speed, self.direction], n, dead)
 
-        self.speed = max(0, self.speed - 0.1)
-        return not self.speed
+    # diamond corners of every spark, shape (count, 4, 2)
+    # long along the direction of travel and thin across it, shrinking as the spark slows
+    def vertices(self, offset=(0, 0)):
+        n = self.count
+        pos = self.pos[:n] - offset
+        speed = self.speed[:n, None]
+        along = self.direction[:n] * speed * 3
+        # direction turned by 90 degrees
+        across = self.direction[:n, ::-1] * (-1, 1) * speed * 0.5
+        return np.stack((pos + along, pos + across, pos - along, pos - across),
+                        axis=1)
 
     def render(self, surf, offset=(0, 0)):
-        render_points = [
-            (self.pos[0] + math.cos(self.angle) * self.speed * 3 - offset[0],
-             self.pos[1] + math.sin(self.angle) * self.speed * 3 - offset[1]),
-            (self.pos[0] +
-             math.cos(self.angle + math.pi * 0.5) * self.speed * 0.5 -
-             offset[0], self.pos[1] +
-             math.sin(self.angle + math.pi * 0.5) * self.speed * 0.5 -
-             offset[1]),
-            (self.pos[0] + math.cos(self.angle + math.pi) * self.speed * 3 -
-             offset[0], self.pos[1] +
-             math.sin(self.angle + math.pi) * self.speed * 3 - offset[1]),
-            (self.pos[0] +
-             math.cos(self.angle - math.pi * 0.5) * self.speed * 0.5 -
-             offset[0], self.pos[1] +
-             math.sin(self.angle - math.pi * 0.5) * self.speed * 0.5 -
-             offset[1]),
-        ]
-        pygame.draw.polygon(surf, (255, 255, 255), render_points)
+        if not self.count:
+            return
+        points = self.vertices(offset)
+        # skip sparks that are entirely off screen
+        width, height = surf.get_size()
+        low = points.min(axis=1)
+        high = points.max(axis=1)
+        visible = ((high[:, 0] >= 0) & (low[:, 0] < width) & (high[:, 1] >= 0)
+                   & (low[:, 1] < height))
+        # pygame has no batched polygon call, so this is one draw per visible spark
+        for corners in points[visible].tolist():
+            pygame.draw.polygon(surf, (255, 255, 255), corners)
@@ -0,0 +1,173 @@
+import pygame
+
+# size of the cells offgrid tiles are bucketed into, in pixels
+OFFGRID_CELL_SIZE = 64
+
+
+# uniform grid over the offgrid tiles so lookups cost time proportional to the result
+# every tile is bucketed into each cell its image overlaps
+class OffgridIndex:
+
+    def __init__(self, cell_size=OFFGRID_CELL_SIZE):
+        self.cell_size = cell_size
+        # (cell_x, cell_y) -> list of entries
+        self.cells = {}
+        # (type, variant) -> list of entries
+        self.by_id = {}
+        # id(tile) -> [order, rect, tile], tile dicts aren't hashable so they're keyed by identity
+        # the order keeps results in list order so overlapping tiles draw the same way
+        self.entries = {}
+        self.next_order = 0
+
+    def clear(self):
+        self.cells = {}
+        self.by_id = {}
+        self.entries = {}
+        self.next_order = 0
+
+    def cell_range(self, rect):
+        return (range(rect.left // self.cell_size,
+                      (rect.right - 1) // self.cell_size + 1),
+                range(rect.top // self.cell_size,
+                      (rect.bottom - 1) // self.cell_size + 1))
+
+    # order places the tile among the others, by default it goes after every tile added so far
+    def add(self, tile, rect, order=None):
+        rect = pygame.Rect(rect)
+        if order is None:
+            order = self.next_order
+            self.next_order += 1
+        entry = [order, rect, tile]
+        self.entries[id(tile)] = entry
+        self.by_id.setdefault((tile['type'], tile['variant']),
+                              []).append(entry)
+        xs, ys = self.cell_range(rect)
+        for cx in xs:
+            for cy in ys:
+                self.cells.setdefault((cx, cy), []).append(entry)
+
+    def remove(self, tile):
+        entry = self.entries.pop(id(tile))
+        self.by_id[(tile['type'], tile['variant'])].remove(entry)
+        xs, ys = self.cell_range(entry[1])
+        for cx in xs:
+            for cy in ys:
+                cell = self.cells[(cx, cy)]
+                cell.remove(entry)
+                if not cell:
+                    del self.cells[(cx, cy)]
+        return entry[1]
+
+    def order_of(self, tile):
+        return self.entries[id(tile)][0]
+
+    # tiles whose image overlaps a pixel rect, in list order
+    def query_rect(self, rect):
+        rect = pygame.Rect(rect)
+        found = {}
+        xs, ys = self.cell_range(rect)
+        for cx in xs:
+            for cy in ys:
+                for entry in self.cells.get((cx, cy), ()):
+                    if entry[0] not in found and rect.colliderect(entry[1]):
+                        found[entry[0]] = entry[2]
+        return [found[order] for order in sorted(found)]
+
+    # tiles whose image contains a pixel position, in list order
+    def query_point(self, pos):
+        cell = self.cells.get(
+            (int(pos[0] // self.cell_size), int(pos[1] // self.cell_size)), ())
+        return [entry[2] for entry in cell if entry[1].collidepoint(pos)]
+
+    # tiles matching any of the (type, variant) pairs, in list order
+    def with_ids(self, id_pairs):
+        entries = []
+        for id_pair in set(id_pairs):
+            entries += self.by_id.get(id_pair, ())
+        return [entry[2] for entry in sorted(entries, key=lambda e: e[0])]
+
+
+# size of the cells entities and projectiles are bucketed into, in pixels
+ENTITY_CELL_SIZE = 32
+
+
+# uniform grid over the moving things in the world, rebuilt every step
+# interaction checks only look at the cells they touch, so the cost follows the number of contacts
+# entries are [order, kind, obj, rect, point], point entries have no rect
+class SpatialHash:
+
+    def __init__(self, cell_size=ENTITY_CELL_SIZE):
+        self.cell_size = cell_size
+        # (cell_x, cell_y) -> list of entries
+        self.cells = {}
+        # id(obj) -> entry
+        self.entries = {}
+
+    def clear(self):
+        self.cells = {}
+        self.entries = {}
+
+    def cell_range(self, rect):
+        return (range(rect.left // self.cell_size,
+                      (rect.right - 1) // self.cell_size + 1),
+                range(rect.top // self.cell_size,
+                      (rect.bottom - 1) // self.cell_size + 1))
+
+    def insert(self, kind, obj, rect):
+        rect = pygame.Rect(rect)
+        entry = [len(self.entries), kind, obj, rect, None]
+        self.entries[id(obj)] = entry
+        xs, ys = self.cell_range(rect)
+        for cx in xs:
+            for cy in ys:
+                self.cells.setdefault((cx, cy), []).append(entry)
+
+    # points are bucketed by their truncated position, the pixel pygame.Rect.collidepoint tests
+    def insert_point(self, kind, obj, pos):
+        entry = [len(self.entries), kind, obj, None, tuple(pos)]
+        self.entries[id(obj)] = entry
+        self.cells.setdefault(
+            (int(pos[0]) // self.cell_size, int(pos[1]) // self.cell_size),
+            []).append(entry)
+
+    # the rect an object was inserted with, so it isn't rebuilt by every check
+    def rect_of(self, obj):
+        return self.entries[id(obj)][3]
+
+    # objects overlapping a pixel rect, optionally only of one kind, in insertion order
+    def query_rect(self, rect, kind=None):
+        rect = pygame.Rect(rect)
+        found = {}
+        xs, ys = self.cell_range(rect)
+        for cx in xs:
+            for cy in ys:
+                for entry in self.cells.get((cx, cy), ()):
+                    if entry[0] in found or (kind and entry[1] != kind):
+                        continue
+                    if entry[3] is None:
+                        hit = rect.collidepoint(entry[4])
+                    else:
+                        hit = rect.colliderect(entry[3])
+                    if hit:
+                        found[entry[0]] = entry[2]
+        return [found[order] for order in sorted(found)]
+
+    # objects within radius pixels of a position, measured to the closest point of their rect
+    def nearby(self, pos, radius, kind=None):
+        found = {}
+        xs, ys = self.cell_range(
+            pygame.Rect(pos[0] - radius, pos[1] - radius, radius * 2 + 1,
+                        radius * 2 + 1))
+        for cx in xs:
+            for cy in ys:
+                for entry in self.cells.get((cx, cy), ()):
+                    if entry[0] in found or (kind and entry[1] != kind):
+                        continue
+                    if entry[3] is None:
+                        x, y = entry[4]
+                    else:
+                        x = min(max(pos[0], entry[3].left), entry[3].right)
+                        y = min(max(pos[1], entry[3].top), entry[3].bottom)
+                    if (x - pos[0])**2 + (y - pos[1])**2 <= radius**2:
+                        found[entry[0]] = entry[2]
+        return [found[order] for order in sorted(found)]
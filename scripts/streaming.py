@@ -0,0 +1,174 @@
+import math
+import numpy as np
+from collections import OrderedDict
+from scripts.mapfile import pack_chunk_keys
+
+# default cap on resident chunk data, a 16x16 chunk is 512 bytes
+DEFAULT_RESIDENT_BYTES = 2 * 1024 * 1024
+
+
+# drop-in replacement for Tilemap.chunks that pages chunks in from a memory-mapped binary map
+# chunks are loaded ahead of the camera by update() and on demand by any lookup,
+# so physics and other queries never see a missing chunk that exists in the file
+# the offgrid tiles of the file are paged into the tilemap per chunk by update() as well
+class StreamedChunks(dict):
+
+    def __init__(self,
+                 tilemap,
+                 source,
+                 chunk_type,
+                 radius=2,
+                 max_bytes=DEFAULT_RESIDENT_BYTES,
+                 offgrid=None):
+        super().__init__()
+        self.tilemap = tilemap
+        # chunk key -> (types, variants) views into the map file, a MapChunks
+        self.source = source
+        # offgrid records of the map file, a MapOffgrid
+        self.offgrid = offgrid
+        self.chunk_type = chunk_type
+        # chunks within this many chunks of the screen are kept loaded
+        self.radius = radius
+        self.max_bytes = max_bytes
+        self.resident_bytes = 0
+        # unedited resident chunks from least to most recently near the camera
+        self.lru = OrderedDict()
+        # edited chunks are never evicted so edits are not lost
+        self.pinned = set()
+        # chunks deleted since loading, the file still has them
+        self.deleted = set()
+        # chunk key -> (record indices, tiles) of the offgrid tiles paged into the tilemap
+        self.offgrid_pages = {}
+        # chunks with edited offgrid tiles, their tiles are never paged out
+        self.pinned_offgrid = set()
+
+    def fetch(self, key):
+        if key in self.deleted:
+            return None
+        arrays = self.source.get(key)
+        if arrays is None:
+            return None
+        types, variants = arrays
+        # copy out of the map so the chunk is resident and edits don't touch the file pages
+        chunk = self.chunk_type(np.array(types), np.array(variants))
+        dict.__setitem__(self, key, chunk)
+        self.lru[key] = None
+        self.resident_bytes += chunk.types.nbytes + chunk.variants.nbytes
+        return chunk
+
+    def get(self, key, default=None):
+        chunk = dict.get(self, key)
+        if chunk is None:
+            chunk = self.fetch(key)
+        return default if chunk is None else chunk
+
+    def __missing__(self, key):
+        chunk = self.fetch(key)
+        if chunk is None:
+            raise KeyError(key)
+        return chunk
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def __setitem__(self, key, chunk):
+        if dict.__contains__(self, key):
+            self.evict(key)
+        dict.__setitem__(self, key, chunk)
+        self.deleted.discard(key)
+        self.pinned.add(key)
+        self.resident_bytes += chunk.types.nbytes + chunk.variants.nbytes
+
+    def __delitem__(self, key):
+        self.evict(key)
+        self.pinned.discard(key)
+        self.deleted.add(key)
+
+    def pin(self, key):
+        if key in self.lru:
+            del self.lru[key]
+            self.pinned.add(key)
+
+    # keys of the chunks that aren't loaded and have cells of a type id and variant in the file
+    def find_unloaded(self, t_id, variant):
+        return [
+            key for key in self.source.find(t_id, variant)
+            if key not in self.deleted and not dict.__contains__(self, key)
+        ]
+
+    def pin_offgrid(self, key):
+        self.pinned_offgrid.add(key)
+
+    def page_offgrid(self, key):
+        if self.offgrid is None or key in self.offgrid_pages:
+            return
+        indices = self.offgrid.in_chunk(key)
+        tiles = self.offgrid.tiles(indices)
+        self.offgrid_pages[key] = (indices, tiles)
+        # the record index keeps the file's draw order between paged tiles
+        for i, tile in zip(indices.tolist(), tiles):
+            self.tilemap.insert_offgrid(tile, i)
+
+    def unpage_offgrid(self, key):
+        for tile in self.offgrid_pages.pop(key)[1]:
+            self.tilemap.discard_offgrid(tile)
+
+    # the record indices among indices whose chunk isn't paged in
+    def unpaged(self, indices):
+        paged = list(self.offgrid_pages)
+        if not paged:
+            return indices
+        keys = pack_chunk_keys(*self.offgrid.chunk_positions(indices))
+        return indices[~np.isin(keys, pack_chunk_keys(*zip(*paged)))]
+
+    # (record index, tile) of the offgrid records matching the (type, variant) pairs that aren't paged in,
+    # without keep the records are taken out of the map
+    def extract_offgrid(self, id_pairs, keep):
+        if self.offgrid is None:
+            return []
+        indices = self.unpaged(self.offgrid.with_ids(id_pairs))
+        if not keep:
+            self.offgrid.removed[indices] = True
+        return list(zip(indices.tolist(), self.offgrid.tiles(indices)))
+
+    # (record index, tile) of the offgrid records that aren't paged in or removed, for saving
+    def unpaged_offgrid(self):
+        if self.offgrid is None:
+            return []
+        indices = self.unpaged(np.nonzero(~self.offgrid.removed)[0])
+        return list(zip(indices.tolist(), self.offgrid.tiles(indices)))
+
+    def evict(self, key):
+        chunk = dict.pop(self, key)
+        self.lru.pop(key, None)
+        self.resident_bytes -= chunk.types.nbytes + chunk.variants.nbytes
+        self.tilemap.render_cache.invalidate(key)
+
+    # load the chunks around the camera and unload the least recently seen ones
+    # outside the radius until the resident data fits in the budget again
+    def update(self, scroll, view_size):
+        size = self.tilemap.chunk_pixels()
+        x0 = math.floor(scroll[0] / size) - self.radius
+        x1 = math.floor((scroll[0] + view_size[0]) / size) + self.radius
+        y0 = math.floor(scroll[1] / size) - self.radius
+        y1 = math.floor((scroll[1] + view_size[1]) / size) + self.radius
+        for cx in range(x0, x1 + 1):
+            for cy in range(y0, y1 + 1):
+                key = (cx, cy)
+                if key in self.lru:
+                    self.lru.move_to_end(key)
+                elif not dict.__contains__(self, key):
+                    self.fetch(key)
+
+                self.page_offgrid(key)
+
+        for key in list(self.lru):
+            if self.resident_bytes <= self.max_bytes:
+                break
+            if not (x0 <= key[0] <= x1 and y0 <= key[1] <= y1):
+                self.evict(key)
+
+        for key in list(self.offgrid_pages):
+            if key not in self.pinned_offgrid and not (x0 <= key[0] <= x1
+                                                       and y0 <= key[1] <= y1):
+                self.unpage_offgrid(key)
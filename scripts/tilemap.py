@@ -1,8 +1,14 @@
 # all permutaitions of -1,0,1 in pairs
-import pygame
+import math
+import itertools
 import json
 import asyncio
 import numpy as np
+from collections.abc import MutableMapping
+from scripts.chunk_cache import ChunkRenderCache
+from scripts.mapfile import is_binary_path, read_map, write_map
+from scripts.streaming import StreamedChunks, DEFAULT_RESIDENT_BYTES
+from scripts.spatial import OffgridIndex
 
 AUTOTILE_MAP = {
     # sorted to hash tuples in any order
@@ -32,27 +38,326 @@ NEIGHBOUR_OFFSETS = [(-1, 0), (-1, -1), (0, -1), (1, -1), (1, 0), (0, 0),
 PHYSICS_TILES = {'grass', 'stone'}
 AUTOTILE_TILES = {'grass', 'stone'}
 
+# bit for each direction in a neighbour bitmask
+AUTOTILE_BITS = {(1, 0): 1, (-1, 0): 2, (0, 1): 4, (0, -1): 8}
+# AUTOTILE_MAP as a table indexed by neighbour bitmask, -1 where the map has no variant
+AUTOTILE_LUT = np.full(16, -1, dtype=np.int16)
+for neighbours, variant in AUTOTILE_MAP.items():
+    AUTOTILE_LUT[sum(AUTOTILE_BITS[shift] for shift in neighbours)] = variant
+
+# tiles are stored in square chunks of CHUNK_SIZE x CHUNK_SIZE grid cells
+CHUNK_SIZE = 16
+# types of a chunk that isn't stored, for lookups that read missing chunks
+EMPTY_CHUNK_TYPES = np.zeros((CHUNK_SIZE, CHUNK_SIZE), dtype=np.uint8)
+# type ids are stored as uint8 and id 0 marks an empty cell
+MAX_TILE_TYPES = 255
+# every edit of any tilemap gets a new revision, so equal revisions mean equal tiles
+REVISIONS = itertools.count(1)
+
+
+def read_json_map(path):
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+class Chunk:
+
+    def __init__(self, types=None, variants=None):
+        # arrays are indexed [y][x] with coordinates local to the chunk
+        # types holds ids into Tilemap.tile_types, 0 means there is no tile
+        # loaded chunks can pass in views of a memory-mapped map file
+        if types is None:
+            types = np.zeros((CHUNK_SIZE, CHUNK_SIZE), dtype=np.uint8)
+        if variants is None:
+            variants = np.zeros((CHUNK_SIZE, CHUNK_SIZE), dtype=np.uint8)
+        self.types = types
+        self.variants = variants
+
+    def empty(self):
+        return not self.types.any()
+
+
+# copy of a tilemap's tiles that restore puts back without reading the map file again
+class TilemapSnapshot:
+
+    def __init__(self, tilemap):
+        self.tile_size = tilemap.tile_size
+        self.tile_types = tilemap.tile_types[1:]
+        self.chunks = {
+            key: (chunk.types.copy(), chunk.variants.copy())
+            for key, chunk in tilemap.chunks.items()
+        }
+        self.offgrid_tiles = [tile.copy() for tile in tilemap.offgrid_tiles]
+        self.revision = tilemap.revision
+
+
+class TileView(MutableMapping):
+
+    # dict-like view with the old 'x;y' keys over the chunk storage
+    # so code written against the dict (editor, save files) keeps working
+    # the tile dicts it hands out are copies, edit tiles through set_tile/remove_tile
+    # or by assigning a new dict to the key
+    def __init__(self, tilemap):
+        self.tilemap = tilemap
+
+    @staticmethod
+    def parse_key(key):
+        x, y = key.split(';')
+        return int(x), int(y)
+
+    def __getitem__(self, key):
+        tile = self.tilemap.get_tile(*self.parse_key(key))
+        if tile is None:
+            raise KeyError(key)
+        return tile
+
+    def __setitem__(self, key, tile):
+        x, y = self.parse_key(key)
+        self.tilemap.set_tile(x, y, tile['type'], tile['variant'])
+
+    def __delitem__(self, key):
+        if not self.tilemap.remove_tile(*self.parse_key(key)):
+            raise KeyError(key)
+
+    def __contains__(self, key):
+        return self.tilemap.tile_type_at(*self.parse_key(key)) != 0
+
+    def __iter__(self):
+        for x, y, _, _ in self.tilemap.tile_locs():
+            yield str(x) + ';' + str(y)
+
+    def __len__(self):
+        return sum(
+            int(np.count_nonzero(chunk.types))
+            for chunk in self.tilemap.chunks.values())
+
 
 class Tilemap:
 
     def __init__(self, game, tile_size=16):
         self.game = game
         self.tile_size = tile_size
-        self.tilemap = {
-        }  # only do physics here, easier to optimize if stuff is on a grid
+        # only do physics on the grid, easier to optimize if stuff is on a grid
+        # grid tiles live in chunks keyed by (chunk_x, chunk_y) so that we don't need to fill empty space
+        # a tile at grid position (x, y) is in chunk (x // CHUNK_SIZE, y // CHUNK_SIZE)
+        self.chunks = {}
+        # palette of tile types, the index of a type is the id stored in the chunks
+        self.tile_types = [None]
+        self.type_ids = {}
+        # lookup tables indexed by type id so checks are integer indexing instead of set lookups
+        self.solid_types = np.zeros(MAX_TILE_TYPES + 1, dtype=bool)
+        self.autotile_types = np.zeros(MAX_TILE_TYPES + 1, dtype=bool)
+        # offgrid tiles are kept in a list for saving and in a grid index for lookups
+        self.offgrid_index = OffgridIndex()
         self.offgrid_tiles = []
-        # use a dict for tilemap so that we don't need to fill empty space
-        # can store location like '3;10': 'grass'
-        # can use tuples but this is easier due to how files are stored
+        # static tiles are baked into one surface per chunk and redrawn only when they change
+        self.render_cache = ChunkRenderCache(self, CHUNK_SIZE)
+        # changes on every edit, see snapshot/restore
+        self.revision = next(REVISIONS)
+
+    # dict view of the grid tiles keyed by 'x;y', kept for compatibility
+    @property
+    def tilemap(self):
+        return TileView(self)
+
+    @tilemap.setter
+    def tilemap(self, tiles):
+        self.chunks = {}
+        self.revision = next(REVISIONS)
+        self.render_cache.clear()
+        for tile in tiles.values():
+            self.set_tile(tile['pos'][0], tile['pos'][1], tile['type'],
+                          tile['variant'])
+
+    # add and remove offgrid tiles with add_offgrid/remove_offgrid so the index stays in sync
+    @property
+    def offgrid_tiles(self):
+        return self._offgrid_tiles
+
+    @offgrid_tiles.setter
+    def offgrid_tiles(self, tiles):
+        self._offgrid_tiles = tiles
+        self.revision = next(REVISIONS)
+        self.offgrid_index.clear()
+        for tile in tiles:
+            self.offgrid_index.add(tile, self.offgrid_rect(tile))
+
+    # true when chunks are paged in from a binary map around the camera
+    @property
+    def streaming(self):
+        return isinstance(self.chunks, StreamedChunks)
+
+    def chunk_pixels(self):
+        return CHUNK_SIZE * self.tile_size
+
+    def type_id(self, tile_type):
+        if tile_type not in self.type_ids:
+            if len(self.tile_types) > MAX_TILE_TYPES:
+                raise ValueError('too many tile types in tilemap')
+            t_id = len(self.tile_types)
+            self.tile_types.append(tile_type)
+            self.type_ids[tile_type] = t_id
+            self.solid_types[t_id] = tile_type in PHYSICS_TILES
+            self.autotile_types[t_id] = tile_type in AUTOTILE_TILES
+        return self.type_ids[tile_type]
+
+    # replace the palette, ids in existing chunks are not remapped
+    def set_palette(self, tile_types):
+        self.tile_types = [None]
+        self.type_ids = {}
+        self.solid_types[:] = False
+        self.autotile_types[:] = False
+        for tile_type in tile_types:
+            self.type_id(tile_type)
+
+    # type id of the tile at a grid position, 0 if there is no tile
+    def tile_type_at(self, x, y):
+        chunk = self.chunks.get((x // CHUNK_SIZE, y // CHUNK_SIZE))
+        if chunk is None:
+            return 0
+        return chunk.types[y % CHUNK_SIZE, x % CHUNK_SIZE]
+
+    def get_tile(self, x, y):
+        chunk = self.chunks.get((x // CHUNK_SIZE, y // CHUNK_SIZE))
+        if chunk is None:
+            return None
+        t_id = chunk.types[y % CHUNK_SIZE, x % CHUNK_SIZE]
+        if not t_id:
+            return None
+        return {
+            'type': self.tile_types[t_id],
+            'variant': int(chunk.variants[y % CHUNK_SIZE, x % CHUNK_SIZE]),
+            'pos': [x, y]
+        }
+
+    def set_tile(self, x, y, tile_type, variant=0):
+        t_id = self.type_id(tile_type)
+        key = (x // CHUNK_SIZE, y // CHUNK_SIZE)
+        lx, ly = x % CHUNK_SIZE, y % CHUNK_SIZE
+        if key not in self.chunks:
+            self.chunks[key] = Chunk()
+        chunk = self.chunks[key]
+        old_id = chunk.types[ly, lx]
+        # skip no-op writes so painting over the same tile doesn't rebake the chunk
+        if old_id == t_id and chunk.variants[ly, lx] == variant:
+            return False
+        chunk.types[ly, lx] = t_id
+        chunk.variants[ly, lx] = variant
+        self.tile_changed(key, old_id, t_id)
+        return True
 
-        # example code to populate tilemap
-        # for i in range(10):
-        #     # vertical line of grass from 3 to 12 at y=10
-        #     self.tilemap[str(3+i) + ';10'] = {'type': 'grass', 'variant': 1, 'pos': (3+i,10)}
-        #     # extract pos as tuple here because they are easier to work with
+    def remove_tile(self, x, y):
+        key = (x // CHUNK_SIZE, y // CHUNK_SIZE)
+        lx, ly = x % CHUNK_SIZE, y % CHUNK_SIZE
+        chunk = self.chunks.get(key)
+        if chunk is None or not chunk.types[ly, lx]:
+            return False
+        old_id = chunk.types[ly, lx]
+        chunk.types[ly, lx] = 0
+        chunk.variants[ly, lx] = 0
+        if chunk.empty():
+            del self.chunks[key]
+        self.tile_changed(key, old_id, 0)
+        return True
 
-        #     # horizontal line
-        #     self.tilemap['10;' + str(5+i)] = {'type': 'stone', 'variant': 1, 'pos': (10,5+i)}
+    # drop everything cached for a chunk after one of its tiles changed type or variant
+    def tile_changed(self, key, old_id, new_id):
+        self.revision = next(REVISIONS)
+        self.render_cache.invalidate_tiles(key, (old_id, new_id))
+        # keep edited chunks loaded, unloading them would lose the edit
+        if self.streaming:
+            self.chunks.pin(key)
+
+    def offgrid_rect(self, tile):
+        # size offgrid tiles by their image, fall back to one grid cell for types without assets
+        images = self.game.assets.get(tile['type']) if self.game else None
+        if images is None:
+            return (tile['pos'][0], tile['pos'][1], self.tile_size,
+                    self.tile_size)
+        img = images[tile['variant']]
+        return (tile['pos'][0], tile['pos'][1], img.get_width(),
+                img.get_height())
+
+    # chunk an offgrid tile's position falls in, streamed maps page offgrid tiles by it
+    def offgrid_chunk(self, tile):
+        return (math.floor(tile['pos'][0] / self.chunk_pixels()),
+                math.floor(tile['pos'][1] / self.chunk_pixels()))
+
+    def add_offgrid(self, tile):
+        self.insert_offgrid(tile)
+        self.revision = next(REVISIONS)
+        # keep edited offgrid tiles loaded, paging them out would lose the edit
+        if self.streaming:
+            self.chunks.pin_offgrid(self.offgrid_chunk(tile))
+
+    def remove_offgrid(self, tile):
+        self.discard_offgrid(tile)
+        self.revision = next(REVISIONS)
+        if self.streaming:
+            self.chunks.pin_offgrid(self.offgrid_chunk(tile))
+
+    # add_offgrid and remove_offgrid without counting as an edit, for paging streamed tiles in and out
+    def insert_offgrid(self, tile, order=None):
+        self.offgrid_tiles.append(tile)
+        rect = self.offgrid_rect(tile)
+        self.offgrid_index.add(tile, rect, order)
+        self.render_cache.invalidate_rect(rect)
+
+    def discard_offgrid(self, tile):
+        self.offgrid_tiles.remove(tile)
+        self.render_cache.invalidate_rect(self.offgrid_index.remove(tile))
+
+    # offgrid tiles whose image overlaps a pixel rect
+    def offgrid_in_rect(self, rect):
+        return self.offgrid_index.query_rect(rect)
+
+    # offgrid tiles whose image contains a pixel position
+    def offgrid_at(self, pos):
+        return self.offgrid_index.query_point(pos)
+
+    # grid bounds (x, y, width, height) covering every chunk, None for an empty map
+    def bounds(self):
+        if not self.chunks:
+            return None
+        xs = [key[0] for key in self.chunks]
+        ys = [key[1] for key in self.chunks]
+        return (min(xs) * CHUNK_SIZE, min(ys) * CHUNK_SIZE,
+                (max(xs) - min(xs) + 1) * CHUNK_SIZE,
+                (max(ys) - min(ys) + 1) * CHUNK_SIZE)
+
+    # chunks overlapping a grid area with the overlapping slices of the area and of the chunk
+    def chunk_slices(self, x, y, width, height):
+        for cx in range(x // CHUNK_SIZE, (x + width - 1) // CHUNK_SIZE + 1):
+            for cy in range(y // CHUNK_SIZE,
+                            (y + height - 1) // CHUNK_SIZE + 1):
+                chunk = self.chunks.get((cx, cy))
+                if chunk is None:
+                    continue
+                x0 = max(x, cx * CHUNK_SIZE)
+                x1 = min(x + width, (cx + 1) * CHUNK_SIZE)
+                y0 = max(y, cy * CHUNK_SIZE)
+                y1 = min(y + height, (cy + 1) * CHUNK_SIZE)
+                area = (slice(y0 - y, y1 - y), slice(x0 - x, x1 - x))
+                local = (slice(y0 - cy * CHUNK_SIZE, y1 - cy * CHUNK_SIZE),
+                         slice(x0 - cx * CHUNK_SIZE, x1 - cx * CHUNK_SIZE))
+                yield (cx, cy), chunk, area, local
+
+    # copy the type ids and variants of a grid area into dense [y][x] arrays
+    def region(self, x, y, width, height):
+        types = np.zeros((height, width), dtype=np.uint8)
+        variants = np.zeros((height, width), dtype=np.uint8)
+        for _, chunk, area, local in self.chunk_slices(x, y, width, height):
+            types[area] = chunk.types[local]
+            variants[area] = chunk.variants[local]
+        return types, variants
+
+    # iterate over (x, y, type_id, variant) of every grid tile
+    def tile_locs(self):
+        for (cx, cy), chunk in list(self.chunks.items()):
+            ys, xs = np.nonzero(chunk.types)
+            for ly, lx in zip(ys.tolist(), xs.tolist()):
+                yield (cx * CHUNK_SIZE + lx, cy * CHUNK_SIZE + ly,
+                       int(chunk.types[ly, lx]), int(chunk.variants[ly, lx]))
 
     # get tiles around a given pixel position
     def tiles_around(self, pos):
@@ -62,109 +367,323 @@ class Tilemap:
                     int(pos[1] // self.tile_size))
         # check all neighbouring tiles
         for offset in NEIGHBOUR_OFFSETS:
-            check_loc = str(tile_loc[0] + offset[0]) + ';' + str(tile_loc[1] +
-                                                                 offset[1])
-            if check_loc in self.tilemap:
-                tiles.append(self.tilemap[check_loc])
+            tile = self.get_tile(tile_loc[0] + offset[0],
+                                 tile_loc[1] + offset[1])
+            if tile is not None:
+                tiles.append(tile)
         return tiles
 
-    def physics_rects_around(self, pos):
-        rects = []
-        for tile in self.tiles_around(pos):
-            if tile['type'] in PHYSICS_TILES:
-                rects.append(
-                    pygame.Rect(tile['pos'][0] * self.tile_size,
-                                tile['pos'][1] * self.tile_size,
-                                self.tile_size, self.tile_size))
-        return rects
-
     def solid_check(self, pos):
-        tile_loc = str(int(pos[0] // self.tile_size)) + ';' + str(
-            int(pos[1] // self.tile_size))
-        if tile_loc in self.tilemap:
-            if self.tilemap[tile_loc]['type'] in PHYSICS_TILES:
-                return self.tilemap[tile_loc]
+        tile_x = int(pos[0] // self.tile_size)
+        tile_y = int(pos[1] // self.tile_size)
+        if self.solid_types[self.tile_type_at(tile_x, tile_y)]:
+            return self.get_tile(tile_x, tile_y)
+
+    # solid flags for arrays of grid positions, looked up one chunk at a time
+    def solid_mask(self, tile_xs, tile_ys):
+        tile_xs = np.asarray(tile_xs, dtype=np.int64)
+        tile_ys = np.asarray(tile_ys, dtype=np.int64)
+        if not tile_xs.size:
+            return np.zeros(tile_xs.shape, dtype=bool)
+        # pack chunk coordinates into one int so grouping is a flat unique instead of a row unique
+        keys = ((tile_xs // CHUNK_SIZE) << 32) + (tile_ys // CHUNK_SIZE +
+                                                  (1 << 31))
+        if keys.min() == keys.max():
+            # usually every position is in the same chunk
+            unique = keys.ravel()[:1]
+            inverse = np.zeros(tile_xs.shape, dtype=np.int64)
+        else:
+            unique, inverse = np.unique(keys, return_inverse=True)
+            inverse = inverse.reshape(tile_xs.shape)
+        # stack the chunks' type arrays so every position is read with one fancy index
+        types = []
+        for key in unique.tolist():
+            chunk = self.chunks.get(
+                (key >> 32, (key & 0xffffffff) - (1 << 31)))
+            types.append(EMPTY_CHUNK_TYPES if chunk is None else chunk.types)
+        types = np.stack(types)[inverse, tile_ys % CHUNK_SIZE,
+                                tile_xs % CHUNK_SIZE]
+        return self.solid_types[types]
+
+    # walk the grid cells along the segment from start to end (DDA) and stop at the first solid tile
+    # returns (hit_pos, tile_pos) where hit_pos is the pixel position the segment enters the tile,
+    # or None if the segment is clear. a start inside a solid tile hits at the start
+    def raycast(self, start, end):
+        # plain floats, numpy positions (like entity.pos) would make the sign arithmetic below fail on bools
+        start = (float(start[0]), float(start[1]))
+        end = (float(end[0]), float(end[1]))
+        ts = self.tile_size
+        dx = end[0] - start[0]
+        dy = end[1] - start[1]
+        x = int(start[0] // ts)
+        y = int(start[1] // ts)
+        step_x = (dx > 0) - (dx < 0)
+        step_y = (dy > 0) - (dy < 0)
+        # t is the fraction of the segment travelled, t_max is where the next cell border is crossed
+        t_max_x = ((x + (step_x > 0)) * ts - start[0]) / dx if dx else math.inf
+        t_max_y = ((y + (step_y > 0)) * ts - start[1]) / dy if dy else math.inf
+        t_delta_x = ts / abs(dx) if dx else math.inf
+        t_delta_y = ts / abs(dy) if dy else math.inf
+        t = 0.0
+        while t <= 1:
+            if self.solid_types[self.tile_type_at(x, y)]:
+                return (start[0] + dx * t, start[1] + dy * t), (x, y)
+            if t_max_x < t_max_y:
+                t = t_max_x
+                t_max_x += t_delta_x
+                x += step_x
+            else:
+                t = t_max_y
+                t_max_y += t_delta_y
+                y += step_y
+        return None
+
+    # raycast for arrays of segments at once, starts and ends are (n, 2) pixel positions
+    # returns a hit mask, the hit positions and the hit grid positions (only valid where hit)
+    def raycast_many(self, starts, ends):
+        ts = self.tile_size
+        starts = np.asarray(starts, dtype=np.float64).reshape(-1, 2)
+        ends = np.asarray(ends, dtype=np.float64).reshape(-1, 2)
+        delta = ends - starts
+        cells = np.floor(starts / ts).astype(np.int64)
+        steps = np.sign(delta).astype(np.int64)
+        moving = delta != 0
+        with np.errstate(divide='ignore', invalid='ignore'):
+            t_max = np.where(moving,
+                             ((cells + (steps > 0)) * ts - starts) / delta,
+                             np.inf)
+            t_delta = np.where(moving, ts / np.abs(delta), np.inf)
+        t = np.zeros(len(starts))
+        hit = np.zeros(len(starts), dtype=bool)
+        active = np.arange(len(starts))
+        while active.size:
+            solid = self.solid_mask(cells[active, 0], cells[active, 1])
+            hit[active[solid]] = True
+            active = active[~solid]
+            # step every remaining ray over its nearest cell border
+            axis = (t_max[active, 1] <= t_max[active, 0]).astype(np.int64)
+            t[active] = t_max[active, axis]
+            t_max[active, axis] += t_delta[active, axis]
+            cells[active, axis] += steps[active, axis]
+            active = active[t[active] <= 1]
+        hit_pos = starts + delta * t[:, None]
+        return hit, hit_pos, cells
 
     def render(self, surf, offset=np.array((0, 0))):
-        # render offgrid tiles first because they are background
-        for tile in self.offgrid_tiles:
-            # offgrid_tiles contains the same thing as tilemap but in a list
-            # the pos is pixels here not on the grid so we don't need to scale pos with tile_size
-            surf.blit(self.game.assets[tile['type']][tile['variant']],
-                      (tile['pos'][0] - offset[0], tile['pos'][1] - offset[1]))
-
-        # render grid tiles
-        for x in range(offset[0] // self.tile_size,
-                       (offset[0] + surf.get_width()) // self.tile_size + 1):
-            for y in range(offset[1] // self.tile_size,
-                           (offset[1] + surf.get_height()) // self.tile_size +
-                           1):
-                loc = str(x) + ';' + str(y)
-                if loc in self.tilemap:
-                    tile = self.tilemap[loc]
-                    surf.blit(self.game.assets[tile['type']][tile['variant']],
-                              (tile['pos'][0] * self.tile_size - offset[0],
-                               tile['pos'][1] * self.tile_size - offset[1]))
-
-        # non-optimized version that renders all tiles instead of only the ones on screen
-        # for loc in self.tilemap:
-        #     tile = self.tilemap[loc]
-        #     # print(tile)
-        #     # print(self.game.assets[tile['type']])
-        #     surf.blit(self.game.assets[tile['type']][tile['variant']],
-        #               (tile['pos'][0]*self.tile_size - offset[0],
-        #                tile['pos'][1]*self.tile_size - offset[1])
-        #             )
+        # offgrid and grid tiles are drawn from the baked chunk surfaces
+        # a frame costs one blit per visible chunk however dense the level is
+        self.render_cache.render(surf, offset)
 
+    # grid tiles as {key: (types, variants)} and offgrid tiles in list order
+    # a streamed map adds what its file has that isn't loaded or was deleted
+    def map_contents(self):
+        if not self.streaming:
+            return {
+                key: (chunk.types, chunk.variants)
+                for key, chunk in self.chunks.items()
+            }, self.offgrid_tiles
+
+        chunks = {
+            key: (chunk.types, chunk.variants)
+            for key, chunk in dict.items(self.chunks)
+        }
+        for key, arrays in self.chunks.source.items():
+            if key not in chunks and key not in self.chunks.deleted:
+                chunks[key] = arrays
+        offgrid = [(self.offgrid_index.order_of(tile), tile)
+                   for tile in self.offgrid_tiles]
+        offgrid += self.chunks.unpaged_offgrid()
+        offgrid.sort(key=lambda item: item[0])
+        return chunks, [tile for _, tile in offgrid]
+
+    # the format is picked from the extension, .tmap is binary and anything else is json
     def save(self, path):
+        chunks, offgrid = self.map_contents()
+        if is_binary_path(path):
+            # offgrid tile types need ids in the palette too
+            for tile in offgrid:
+                self.type_id(tile['type'])
+            write_map(path, self.tile_size, CHUNK_SIZE, self.tile_types[1:],
+                      chunks, offgrid)
+            return
+
+        tiles = {}
+        for (cx, cy), (types, variants) in chunks.items():
+            ys, xs = np.nonzero(types)
+            for ly, lx in zip(ys.tolist(), xs.tolist()):
+                x = cx * CHUNK_SIZE + lx
+                y = cy * CHUNK_SIZE + ly
+                tiles[str(x) + ';' + str(y)] = {
+                    'type': self.tile_types[types[ly, lx]],
+                    'variant': int(variants[ly, lx]),
+                    'pos': [x, y]
+                }
         with open(path, 'w') as f:
             json.dump(
                 {
-                    'tilemap': self.tilemap,
-                    'size': self.tile_size,
-                    'offgrid': self.offgrid_tiles
+                    'tilemap': tiles,
+                    'tile_size': self.tile_size,
+                    'offgrid': offgrid
                 }, f)
 
+    # the file is read and parsed on the event loop's default executor
     async def load(self, path):
-        with open(path, 'r') as f:
-            map_data = json.load(f)
+        reader = read_map if is_binary_path(path) else read_json_map
+        map_data = await asyncio.get_running_loop().run_in_executor(
+            None, reader, path)
+        self.use_map_data(map_data)
+
+    # put the tiles of a parsed map in place, map_data comes from read_json_map or read_map
+    def use_map_data(self, map_data):
+        if 'chunks' in map_data:
+            self.use_binary(map_data)
+            return
 
         self.tilemap = map_data['tilemap']
         self.tile_size = map_data['tile_size']
         self.offgrid_tiles = map_data['offgrid']
+        self.render_cache.clear()
 
-    def autotile(self):
-        for loc in self.tilemap:
-            tile = self.tilemap[loc]
-            if tile['type'] not in AUTOTILE_TILES:
-                continue
-            neighbors = set()
-            for shift in [(-1, 0), (1, 0), (0, 1), (0, -1)]:
-                check_loc = str(tile['pos'][0] +
-                                shift[0]) + ';' + str(tile['pos'][1] +
-                                                      shift[1])
-                if check_loc in self.tilemap:
-                    if self.tilemap[check_loc]['type'] == tile['type']:
-                        neighbors.add(shift)
-            neighbors = tuple(sorted(neighbors))
-            if neighbors in AUTOTILE_MAP:
-                tile['variant'] = AUTOTILE_MAP[neighbors]
+    # with stream=True only the chunks near the camera are kept in memory, see update_streaming
+    def load_binary(self,
+                    path,
+                    stream=False,
+                    radius=2,
+                    max_bytes=DEFAULT_RESIDENT_BYTES):
+        self.use_binary(read_map(path), stream, radius, max_bytes)
+
+    def use_binary(self,
+                   map_data,
+                   stream=False,
+                   radius=2,
+                   max_bytes=DEFAULT_RESIDENT_BYTES):
+        if map_data['chunk_size'] != CHUNK_SIZE:
+            raise ValueError('map chunk size ' + str(map_data['chunk_size']) +
+                             ' does not match ' + str(CHUNK_SIZE))
+        # ids in the file index its palette so the chunk arrays can be used as they are
+        self.set_palette(map_data['palette'])
+        self.tile_size = map_data['tile_size']
+        if stream:
+            self.chunks = StreamedChunks(self, map_data['chunks'], Chunk,
+                                         radius, max_bytes,
+                                         map_data['offgrid'])
+            # offgrid tiles are paged in with the chunks, tiles added later draw after the file's
+            self.offgrid_tiles = []
+            self.offgrid_index.next_order = len(map_data['offgrid'])
+        else:
+            self.chunks = {
+                key: Chunk(types, variants)
+                for key, (types, variants) in map_data['chunks'].items()
+            }
+            self.offgrid_tiles = map_data['offgrid'].tiles()
+        self.render_cache.clear()
+
+    # streamed maps can't be snapshotted, their chunks are paged from the file
+    def snapshot(self):
+        if self.streaming:
+            raise ValueError('streamed tilemaps have no snapshot')
+        return TilemapSnapshot(self)
+
+    # put back the tiles of a snapshot, the arrays are copied so the snapshot can be restored again
+    # nothing is done when no tile changed since the snapshot was taken or restored,
+    # so the baked chunks stay valid
+    def restore(self, snapshot):
+        if self.revision == snapshot.revision:
+            return
+        self.tile_size = snapshot.tile_size
+        self.set_palette(snapshot.tile_types)
+        self.chunks = {
+            key: Chunk(types.copy(), variants.copy())
+            for key, (types, variants) in snapshot.chunks.items()
+        }
+        self.offgrid_tiles = [tile.copy() for tile in snapshot.offgrid_tiles]
+        self.render_cache.clear()
+        self.revision = snapshot.revision
+
+    def stream(self, path, radius=2, max_bytes=DEFAULT_RESIDENT_BYTES):
+        self.load_binary(path, True, radius, max_bytes)
+
+    # page chunks in around the camera and out once they are far away, call once per frame
+    def update_streaming(self, scroll, view_size):
+        if self.streaming:
+            self.chunks.update(scroll, view_size)
+
+    # pick variants from the neighbours of each tile for an area (x, y, width, height) of the grid
+    # the whole map is done when no area is given
+    def autotile(self, area=None):
+        if area is None:
+            area = self.bounds()
+            if area is None:
+                return
+        x, y, width, height = area
+        # read a 1 tile border so tiles on the edge of the area see their neighbours
+        types, _ = self.region(x - 1, y - 1, width + 2, height + 2)
+        centre = types[1:-1, 1:-1]
+        mask = ((types[1:-1, 2:] == centre) * AUTOTILE_BITS[(1, 0)]
+                | (types[1:-1, :-2] == centre) * AUTOTILE_BITS[(-1, 0)]
+                | (types[2:, 1:-1] == centre) * AUTOTILE_BITS[(0, 1)]
+                | (types[:-2, 1:-1] == centre) * AUTOTILE_BITS[(0, -1)])
+        new_variants = AUTOTILE_LUT[mask]
+        update = self.autotile_types[centre] & (new_variants >= 0)
+
+        for key, chunk, area, local in self.chunk_slices(x, y, width, height):
+            chunk_update = update[area]
+            variants = chunk.variants[local]
+            values = new_variants[area][chunk_update]
+            if np.any(variants[chunk_update] != values):
+                variants[chunk_update] = values
+                self.revision = next(REVISIONS)
+                self.render_cache.invalidate(key)
+                if self.streaming:
+                    self.chunks.pin(key)
+
+    # incremental autotiling for the 3x3 tiles around a tile that was painted or deleted
+    def autotile_around(self, x, y):
+        self.autotile((x - 1, y - 1, 3, 3))
 
     def extract(self, id_pairs, keep=False):
-        matches = []
-        for tile in self.offgrid_tiles.copy():
-            if (tile['type'], tile['variant']) in id_pairs:
-                matches.append(tile.copy())
-                if not keep:
-                    self.offgrid_tiles.remove(tile)
-
-        for loc in self.tilemap.copy():
-            tile = self.tilemap[loc]
-            if (tile['type'], tile['variant']) in id_pairs:
-                matches.append(tile.copy())  # both copies are shallow
-                matches[-1]['pos'] = matches[-1]['pos'].copy()
-                matches[-1]['pos'][0] *= self.tile_size
-                matches[-1]['pos'][1] *= self.tile_size
-                if not keep:
-                    del self.tilemap[loc]
+        offgrid = [(self.offgrid_index.order_of(tile), tile)
+                   for tile in self.offgrid_index.with_ids(id_pairs)]
+        if not keep:
+            for _, tile in offgrid:
+                self.remove_offgrid(tile)
+        # a streamed map also has the offgrid tiles of its file that aren't paged in
+        if self.streaming:
+            offgrid += self.chunks.extract_offgrid(id_pairs, keep)
+            offgrid.sort(key=lambda item: item[0])
+        matches = [tile.copy() for _, tile in offgrid]
+
+        for tile_type, variant in id_pairs:
+            if tile_type not in self.type_ids:
+                continue
+            t_id = self.type_ids[tile_type]
+            chunks = list(self.chunks.items())
+            # a streamed map only has the chunks near the camera loaded, the others are searched in the file
+            # and loaded when they have matches, in key order like a fully loaded map
+            if self.streaming:
+                chunks += [(key, self.chunks[key])
+                           for key in self.chunks.find_unloaded(t_id, variant)]
+                chunks.sort(key=lambda item: item[0])
+            for (cx, cy), chunk in chunks:
+                mask = (chunk.types == t_id) & (chunk.variants == variant)
+                ys, xs = np.nonzero(mask)
+                for ly, lx in zip(ys.tolist(), xs.tolist()):
+                    # pos is converted to pixels like offgrid tiles
+                    matches.append({
+                        'type':
+                        tile_type,
+                        'variant':
+                        variant,
+                        'pos': [(cx * CHUNK_SIZE + lx) * self.tile_size,
+                                (cy * CHUNK_SIZE + ly) * self.tile_size]
+                    })
+                if not keep and len(ys):
+                    self.revision = next(REVISIONS)
+                    chunk.types[mask] = 0
+                    chunk.variants[mask] = 0
+                    if chunk.empty():
+                        del self.chunks[(cx, cy)]
+                    elif self.streaming:
+                        self.chunks.pin((cx, cy))
+                    self.render_cache.invalidate_tiles((cx, cy), (t_id, ))
         return matches
@@ -6,7 +6,13 @@ BASE_IMG_PATH = 'data/images/'
 
 
 def load_img(path):
-    img = pygame.image.load(BASE_IMG_PATH + path).convert()
+    return prepare_img(pygame.image.load(BASE_IMG_PATH + path))
+
+
+def prepare_img(img):
+    # convert to the display format for fast blitting, headless runs have no display to convert to
+    if pygame.display.get_surface() is not None:
+        img = img.convert()
     img.set_colorkey((0, 0, 0))
     return img
 
@@ -20,8 +26,14 @@ def load_images(path):
 
 class Animation:
 
-    def __init__(self, images, img_dur=5, loop=True):
+    def __init__(self, images, img_dur=5, loop=True, flipped=None):
         self.images = images
+        # mirrored frames, made once here unless the atlas already has them
+        if flipped is None:
+            flipped = [
+                pygame.transform.flip(img, True, False) for img in images
+            ]
+        self.flipped = flipped
         self.img_duration = img_dur
         self.loop = loop
         self.done = False
@@ -29,7 +41,8 @@ class Animation:
 
     # copy the animation with a reference to the original images
     def copy(self):
-        return Animation(self.images, self.img_duration, self.loop)
+        return Animation(self.images, self.img_duration, self.loop,
+                         self.flipped)
 
     def update(self):
         if self.loop:
@@ -41,5 +54,6 @@ class Animation:
             if self.frame >= self.img_duration * len(self.images) - 1:
                 self.done = True
 
-    def img(self):
-        return self.images[int(self.frame / self.img_duration)]
+    def img(self, flip=False):
+        images = self.flipped if flip else self.images
+        return images[int(self.frame / self.img_duration)]
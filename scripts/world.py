@@ -0,0 +1,316 @@
+import os
+import math
+import random
+import pygame
+import numpy as np
+from scripts.entities import Player, Enemy
+from scripts.tilemap import Tilemap
+from scripts.physics import PhysicsBodies
+from scripts.spatial import SpatialHash
+from scripts.particle import ParticleSystem
+from scripts.spark import SparkSystem
+from scripts.projectile import ProjectileSystem
+from scripts.snapshot import capture_world, restore_world
+from scripts.levels import (LevelLoader, capture_level, level_count,
+                            level_path, read_level, MAPS_PATH)
+
+# the simulation always steps at 60 steps per second, like the old frame-locked loop
+TIMESTEP = 1 / 60
+# cap on catch-up steps per advance so a long stall doesn't freeze the game further
+MAX_STEPS = 5
+
+# steps between the last enemy dying and the next level starting
+TRANSITION_STEPS = 30
+
+# (min, max) angle of a burst that flies out in every direction
+FULL_CIRCLE = (0, 2 * math.pi)
+
+
+# input for one simulation step
+# movement is -1, 0 or 1 on the x axis, jump and dash are one-shot presses
+class Inputs:
+
+    def __init__(self, movement=0, jump=False, dash=False):
+        self.movement = movement
+        self.jump = jump
+        self.dash = dash
+
+
+# everything that is simulated, without any display, event or clock code
+# so it can be stepped headless and faster than real time
+class World:
+
+    def __init__(self,
+                 assets,
+                 view_size=(320, 240),
+                 streaming=False,
+                 seed=None,
+                 maps_path=MAPS_PATH):
+        self.assets = assets
+        # directory the levels are read from, level n is n.json (and n.tmap when streaming)
+        self.maps_path = maps_path
+        # random source for bursts, pass a seed to make them reproducible
+        self.rng = np.random.default_rng(seed)
+        # random source for leaves and enemy walks, per world so snapshots can carry its state
+        self.random = random.Random(seed)
+        # size of the camera view in pixels, the camera follows the player
+        self.view_size = view_size
+        self.tilemap = Tilemap(self, tile_size=16)
+        # stream levels that have a binary .tmap version chunk by chunk around the camera
+        self.streaming = streaming
+        # position, velocity and collisions of the player and every enemy
+        self.bodies = PhysicsBodies()
+        # player, enemies and projectiles bucketed by position, rebuilt every step
+        self.broadphase = SpatialHash()
+        # leaves and dust in one fixed size pool
+        self.particles = ParticleSystem(assets)
+        self.sparks = SparkSystem()
+        self.projectiles = ProjectileSystem(assets)
+        self.player = Player(self, (50, 50), (8, 15))
+        self.enemies = []
+        # map id -> LevelSnapshot, restarting a level restores it instead of reading the map again
+        self.level_cache = {}
+        # the next level is read on a worker thread while this one is played
+        # set loader.on_progress and loader.on_complete to follow its loads
+        self.loader = LevelLoader()
+        self.level_count = level_count(maps_path)
+        self.level = 0
+
+        # leftover real time that hasn't been simulated yet
+        self.accumulator = 0.
+        # presses that arrived when no step was due, applied on the next step
+        self.pending_jump = False
+        self.pending_dash = False
+
+        self.load_level(0)
+
+    # levels seen before or prefetched are restored from the level cache without any file io,
+    # a level still being prefetched is waited for instead of read a second time
+    # streamed levels page their chunks from the file, so they are always loaded again
+    def load_level(self, map_id):
+        self.level = map_id
+        level = self.level_cache.get(map_id)
+        if level is None:
+            if self.streamed(map_id):
+                self.tilemap.stream(self.maps_path + str(map_id) + '.tmap')
+                self.start_level()
+                return
+            if self.loader.loading(map_id):
+                level = self.loader.take(map_id)
+            else:
+                level = read_level(level_path(map_id, self.maps_path))
+            self.level_cache[map_id] = level
+        self.tilemap.restore(level.tiles)
+        self.start_level(level)
+
+    def streamed(self, map_id):
+        return self.streaming and os.path.exists(self.maps_path + str(map_id) +
+                                                 '.tmap')
+
+    # the last level repeats once it is cleared
+    def next_level(self):
+        return min(self.level + 1, self.level_count - 1)
+
+    # spawn the player, enemies and leaf spawners of a level and reset the level state
+    # without a level the spawners are taken from the loaded tilemap
+    def start_level(self, level=None):
+        if level is None:
+            level = capture_level(self.tilemap)
+        self.scroll = np.array([0., 0.])  # camera's location
+        # load the tile groups this level uses now instead of on the first frame
+        self.assets.preload(self.tilemap.tile_types)
+
+        self.leaf_spawners = [
+            pygame.Rect(rect) for rect in level.leaf_spawners
+        ]
+
+        for enemy in self.enemies:
+            enemy.despawn()
+        if level.player_pos is not None:
+            self.player.pos = np.array(level.player_pos)
+            self.player.air_time = 0
+        self.enemies = [
+            Enemy(self, pos, (8, 15)) for pos in level.enemy_positions
+        ]
+
+        self.projectiles.clear()
+        self.particles.clear()
+        self.sparks.clear()
+        self.dead = 0
+        self.transition = 0
+
+        # read the next level while this one is played
+        next_level = self.next_level()
+        if next_level not in self.level_cache and not self.streamed(
+                next_level):
+            self.loader.prefetch(next_level,
+                                 level_path(next_level, self.maps_path))
+
+        self.save_previous()
+
+    # spawn count sparks, or particles of the kind, at center flying out at random angles and speeds
+    # every random value and the trig for the whole burst is one numpy call
+    # frame_range is the inclusive range of starting animation frames for particles
+    def emit_burst(self,
+                   kind,
+                   center,
+                   count,
+                   speed_range,
+                   angle_range=FULL_CIRCLE,
+                   frame_range=(0, 0)):
+        angles = self.rng.uniform(angle_range[0], angle_range[1], count)
+        speeds = self.rng.uniform(speed_range[0], speed_range[1], count)
+        if kind == 'spark':
+            self.sparks.add_many(center, angles, speeds)
+        else:
+            velocity = np.stack(
+                (np.cos(angles), np.sin(angles)), axis=-1) * speeds[:, None]
+            frames = self.rng.integers(frame_range[0], frame_range[1] + 1,
+                                       count)
+            self.particles.add_many(kind, center, velocity, frames)
+
+    # sparks and dust flying out of an entity that got killed
+    def death_burst(self, center):
+        self.emit_burst('spark', center, 30, (2, 3))
+        self.emit_burst('particle', center, 30, (0, 2.5), frame_range=(0, 7))
+
+    # the whole simulation state as packed arrays, see scripts/snapshot.py
+    def snapshot(self):
+        return capture_world(self)
+
+    def restore(self, snapshot):
+        restore_world(self, snapshot)
+
+    # remember the camera and entity positions so rendering can interpolate to the current step
+    def save_previous(self):
+        self.prev_scroll = self.scroll.copy()
+        self.prev_positions = {
+            entity: np.array(entity.pos, dtype=float)
+            for entity in [self.player] + self.enemies
+        }
+
+    # run as many fixed steps as fit in dt seconds of real time
+    # returns how far (0 to 1) the leftover time is into the next step, for interpolation
+    def advance(self, dt, inputs):
+        self.pending_jump = self.pending_jump or inputs.jump
+        self.pending_dash = self.pending_dash or inputs.dash
+        self.accumulator += dt
+        steps = 0
+        while self.accumulator >= TIMESTEP and steps < MAX_STEPS:
+            self.step(
+                Inputs(inputs.movement, self.pending_jump, self.pending_dash))
+            self.pending_jump = False
+            self.pending_dash = False
+            self.accumulator -= TIMESTEP
+            steps += 1
+        if steps == MAX_STEPS:
+            self.accumulator = min(self.accumulator, TIMESTEP)
+        return self.accumulator / TIMESTEP
+
+    def step(self, inputs):
+        self.save_previous()
+
+        if inputs.jump:
+            self.player.jump()
+        if inputs.dash:
+            self.player.dash()
+
+        for map_id, level in self.loader.poll():
+            self.level_cache[map_id] = level
+
+        # reload level if players dies in 40 frames
+        if self.dead:
+            self.dead += 1
+            if self.dead > 40:
+                self.load_level(self.level)
+        # move on a moment after the last enemy dies, the next level is usually prefetched by then
+        elif not self.enemies:
+            self.transition += 1
+            if self.transition > TRANSITION_STEPS:
+                self.load_level(self.next_level())
+
+        # camera offset
+        self.scroll[0] += (self.player.rect().centerx - self.view_size[0] / 2 -
+                           self.scroll[0]) / 30
+        self.scroll[1] += (self.player.rect().centery - self.view_size[1] / 2 -
+                           self.scroll[1]) / 30
+        self.tilemap.update_streaming(self.scroll, self.view_size)
+
+        # randomly generate leaves from plants
+        for rect in self.leaf_spawners:
+            # random.random() = [0,1) times 49999 here so rate of spawning is lower
+            # and positively correlated to size of rect
+            if self.random.random() * 49999 < rect.width * rect.height:
+                # linearly distribute spawning on width and height of rect
+                pos = (rect.x + self.random.random() * rect.width,
+                       rect.y + self.random.random() * rect.height)
+                self.particles.add('leaf',
+                                   pos,
+                                   velocity=(-0.1, 0.3),
+                                   frame=self.random.randint(0, 20))
+
+        # move the enemies and the player in one batched call
+        movers = list(self.enemies)
+        movements = [enemy.think(self.tilemap, (0, 0)) for enemy in movers]
+        if not self.dead:
+            movers.append(self.player)
+            movements.append((inputs.movement, 0))
+        slots = [entity.slot for entity in movers]
+        self.bodies.move_and_collide(self.tilemap, slots, movements)
+
+        for enemy, movement in zip(self.enemies, movements):
+            enemy.after_move(self.tilemap, movement)
+        if not self.dead:
+            self.player.after_move(self.tilemap, movements[-1])
+        self.bodies.apply_friction(slots)
+
+        self.broadphase.clear()
+        self.broadphase.insert('player', self.player, self.player.rect())
+        for enemy in self.enemies:
+            self.broadphase.insert('enemy', enemy, enemy.rect())
+        player_rect = self.broadphase.rect_of(self.player)
+
+        # kill enemies the player collides with while in initial frames of dashing
+        if abs(self.player.dashing) >= 50:
+            for enemy in self.broadphase.query_rect(player_rect, 'enemy'):
+                enemy.die()
+                self.enemies.remove(enemy)
+                enemy.despawn()
+
+        events = self.projectiles.update(self.tilemap)
+        # vfx for projectiles hitting walls
+        for pos, speed in zip(events.wall_pos.tolist(),
+                              events.wall_speed.tolist()):
+            base_angle = math.pi if speed > 0 else 0
+            self.emit_burst('spark', pos, 4, (2, 3),
+                            (base_angle - 0.5, base_angle + 0.5))
+        # the projectiles left are indexed by slot, so hits on the player cost per contact
+        for slot, pos in enumerate(
+                self.projectiles.pos[:self.projectiles.count].tolist()):
+            self.broadphase.insert_point('projectile', slot, pos)
+
+        # vfx for projectile hitting player and player death
+        # projectiles can only hit the player outside the initial frames of dashing
+        if abs(self.player.dashing) < 50:
+            hits = self.broadphase.query_rect(player_rect, 'projectile')
+            if hits:
+                self.projectiles.remove(np.array(hits))
+            for _ in hits:
+                self.dead += 1
+                self.death_burst(player_rect.center)
+
+        self.sparks.update()
+
+        self.particles.update()
+
+    # camera offset between the previous and the current step
+    def render_scroll(self, alpha=1.):
+        scroll = self.prev_scroll + (self.scroll - self.prev_scroll) * alpha
+        return np.array((int(scroll[0]), int(scroll[1])))
+
+    # render offset that draws an entity between its previous and current position
+    def entity_offset(self, entity, offset, alpha=1.):
+        prev = self.prev_positions.get(entity)
+        if prev is None:
+            return offset
+        return offset + (np.array(entity.pos) - prev) * (1 - alpha)